@@ -1,15 +1,25 @@
 import json
-from xlrconfig.configuration_pusher import push_configuration
+from xlrconfig.configuration_pusher import push_configuration, push_configuration_to_targets
 # reload(xlrconfig) uncomment this for faster development cycle
 
 push_config = json.loads(pushConfiguration)
-push_result = push_configuration((server, username, password), push_config, dryRun, {
+xlr_services = {
     'folderApi': folderApi,
     'templateApi': templateApi,
     'configurationApi': configurationApi
-})
+}
 
-stats = json.dumps(push_result['stats'])
-actions = json.dumps(push_result['actions'])
-warnings = json.dumps(push_result['warnings'])
-errors = json.dumps(push_result['errors'])
+if additionalServers:
+    targets = [(server, username, password)] + [(additional_server, None, None)
+                                                for additional_server in additionalServers]
+    push_results = push_configuration_to_targets(targets, push_config, dryRun, xlr_services)
+    stats = json.dumps(dict([(url, result['stats']) for url, result in push_results.items()]))
+    actions = json.dumps(dict([(url, result['actions']) for url, result in push_results.items()]))
+    warnings = json.dumps(dict([(url, result['warnings']) for url, result in push_results.items()]))
+    errors = json.dumps(dict([(url, result['errors']) for url, result in push_results.items()]))
+else:
+    push_result = push_configuration((server, username, password), push_config, dryRun, xlr_services)
+    stats = json.dumps(push_result['stats'])
+    actions = json.dumps(push_result['actions'])
+    warnings = json.dumps(push_result['warnings'])
+    errors = json.dumps(push_result['errors'])
@@ -9,3 +9,22 @@ def get_name(path):
     if '/' in path:
         return path.rsplit('/', 1)[1]
     return path
+
+
+def get_storage_directory(push_spec):
+    """Returns the directory where the plugin keeps data between runs, creating it if needed."""
+    import os
+    import tempfile
+    directory = push_spec.get('storageDirectory') or os.path.join(tempfile.gettempdir(), 'xlrconfig')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def get_storage_file(push_spec, kind, key):
+    """Returns the path of a file where the plugin keeps data between runs, e.g. caches of a given server URL."""
+    import hashlib
+    import os
+    if not isinstance(key, str):
+        key = key.encode('utf-8')
+    return os.path.join(get_storage_directory(push_spec), '%s-%s.json' % (kind, hashlib.sha1(key).hexdigest()[:16]))
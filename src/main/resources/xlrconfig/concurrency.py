@@ -0,0 +1,47 @@
+import random
+import threading
+
+
+def parallel_map(function, items, parallelism):
+    """Applies the function to every item using at most `parallelism` threads, which are JVM threads under Jython.
+    Returns the results in the order of the items. If the function fails for some items, then the error of
+    the first of them is raised."""
+    items = list(items)
+    if parallelism <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    results = [None] * len(items)
+    errors = []
+    next_index = [0]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if errors or next_index[0] >= len(items):
+                    return
+                index = next_index[0]
+                next_index[0] += 1
+            try:
+                results[index] = function(items[index])
+            except Exception as e:
+                with lock:
+                    errors.append((index, e))
+
+    threads = [threading.Thread(target=work, name='xlrconfig-worker-%d' % i)
+               for i in range(min(parallelism, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise min(errors, key=lambda error: error[0])[1]
+    return results
+
+
+def get_backoff_delay(attempt, base_delay, max_delay=60):
+    """Returns the delay in seconds before retrying a request the given time, starting from 0. The delay grows
+    exponentially, and half of it is random, so that the retries of concurrent requests do not come together."""
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
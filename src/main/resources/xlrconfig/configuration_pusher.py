@@ -1,64 +1,266 @@
+from instrumentation import create_instrumentation, merge_stats, log_stats
+from journal import create_journal
 from local_xlr import LocalXlr
-from remote_xlr import RemoteXlr
-from itertools import groupby
+from lookup_cache import create_cache_store
+from manifest import create_manifest
+from plan import get_plan_file, save_plan, load_plan
+from reference_graph import ReferenceGraph
+from push_log import create_push_log, DEFAULT_MAX_ITEMS
+from remote_xlr import RemoteXlr, RemoteRequestError
+from spec import compile_spec
+from template_diff import match_template_ids, get_template_updates, TemplateStructureChanged
+from com.xebialabs.deployit import ServerConfiguration
+from concurrency import parallel_map, get_backoff_delay
 from xlrconfig import get_parent, get_name
+import copy
+import json
+import math
 import re
+import time
+import traceback
 
 
-def push_configuration(connection_details, push_spec, dry_run, xlr_services):
-    pusher = ConfigurationPusher(connection_details, push_spec, dry_run, xlr_services)
+DEFAULT_IMPORT_BATCH_SIZE = 20
+DEFAULT_IMPORT_BATCH_BYTES = 5 * 1024 * 1024
+DEFAULT_IMPORT_CONCURRENCY = 1
+DEFAULT_IMPORT_RETRIES = 3
+DEFAULT_IMPORT_RETRY_DELAY = 1
+DEFAULT_TARGET_PARALLELISM = 4
+
+
+def push_configuration(connection_details, push_spec, dry_run, xlr_services, listener=None):
+    pusher = ConfigurationPusher(connection_details, push_spec, dry_run, xlr_services, listener)
     return pusher.push_configuration()
 
 
+def push_configuration_to_targets(targets_connection_details, push_spec, dry_run, xlr_services, listener=None):
+    """Pushes to several remote instances at the same time, scanning and serialising the local templates once.
+    Returns the results by the URLs of the remote instances. The listener, if any, gets the items with their URL."""
+    local_xlr = LocalXlr(push_spec, xlr_services, create_cache_store(
+        push_spec, 'local-cache', ServerConfiguration.getInstance().getServerUrl()),
+        create_instrumentation(push_spec))
+    pushers = [ConfigurationPusher(connection_details, push_spec, dry_run, xlr_services,
+                                   _get_target_listener(listener, connection_details[0]['url']), local_xlr)
+               for connection_details in targets_connection_details]
+
+    def is_unchanged(template_details):
+        # a template is pushed when it has changed since the last push to any of the targets
+        return all([pusher.is_unchanged(template_details) for pusher in pushers])
+
+    def push_to_target(pusher):
+        try:
+            # every target gets its own copy, as the details are completed with the remote IDs
+            return pusher.push_templates(copy.deepcopy(templates_details))
+        except Exception as e:
+            traceback.print_exc()
+            pusher.errors.append('Could not push the configuration to [%s]: %s' % (pusher.remote_xlr.server['url'], e))
+            return pusher.get_result()
+
+    def apply_plan_to_target(pusher_and_import_levels):
+        pusher, import_levels = pusher_and_import_levels
+        try:
+            return pusher.apply_plan(import_levels)
+        except Exception as e:
+            traceback.print_exc()
+            pusher.errors.append('Could not push the configuration to [%s]: %s' % (pusher.remote_xlr.server['url'], e))
+            return pusher.get_result()
+
+    try:
+        if push_spec.get('plan', {}).get('apply'):
+            # the plans of all targets are checked before importing anything
+            plans = [pusher.load_plan() for pusher in pushers]
+            with local_xlr.instrumentation.phase('local_scan'):
+                reload_planned_templates(local_xlr, plans)
+            results = parallel_map(apply_plan_to_target, list(zip(pushers, plans)),
+                                   push_spec.get('targetParallelism', DEFAULT_TARGET_PARALLELISM))
+        else:
+            incremental = any([pusher.manifest for pusher in pushers])
+            with local_xlr.instrumentation.phase('local_scan'):
+                templates_details = local_xlr.get_templates_to_push(is_unchanged if incremental else None)
+            results = parallel_map(push_to_target, pushers,
+                                   push_spec.get('targetParallelism', DEFAULT_TARGET_PARALLELISM))
+    finally:
+        local_xlr.close()
+        for pusher in pushers:
+            pusher.close()
+    return dict([(pusher.remote_xlr.server['url'], result) for pusher, result in zip(pushers, results)])
+
+
+def reload_planned_templates(local_xlr, plans):
+    """Serialises the templates of the saved plans again, once for all targets, failing if any of them
+    has been changed since the plans were made."""
+    templates_details = []
+    hashes_by_id = {}
+    changed_paths = set()
+    for import_levels in plans:
+        for template in [t for level in import_levels for t in level]:
+            if template['id'] not in hashes_by_id:
+                hashes_by_id[template['id']] = template['hash']
+                templates_details.append(template)
+            elif hashes_by_id[template['id']] != template['hash']:
+                changed_paths.add(template['path'])
+    changed_paths.update(local_xlr.reload_templates(templates_details))
+    if changed_paths:
+        raise Exception('Cannot apply the plan as %d templates have been changed since it was made, make it again '
+                        'with a dry run: %s' % (len(changed_paths), sorted(changed_paths)[:10]))
+
+
+def _get_target_listener(listener, url):
+    if not listener:
+        return None
+    return lambda item_type, item: listener(item_type, {'target': url, 'item': item})
+
+
 # noinspection PyTypeChecker,PyMethodMayBeStatic
 class ConfigurationPusher:
-    def __init__(self, connection_details, push_spec, dry_run, xlr_services):
-        self.local_xlr = LocalXlr(push_spec, xlr_services)
-        self.remote_xlr = RemoteXlr(*connection_details)
+    def __init__(self, connection_details, push_spec, dry_run, xlr_services, listener=None, local_xlr=None):
+        self.instrumentation = create_instrumentation(push_spec)
+        # the local instance may be shared by the pushers to several targets
+        self.local_xlr = local_xlr or LocalXlr(push_spec, xlr_services, create_cache_store(
+            push_spec, 'local-cache', ServerConfiguration.getInstance().getServerUrl()), self.instrumentation)
+        self.remote_xlr = RemoteXlr(*connection_details, options=push_spec.get('remote', {}),
+                                    cache_store=create_cache_store(push_spec, 'remote-cache',
+                                                                   connection_details[0]['url']),
+                                    instrumentation=self.instrumentation)
+        self.manifest = create_manifest(push_spec, connection_details[0]['url'])
+        self.journal = create_journal(push_spec, connection_details[0]['url'])
+        self.template_id_to_imported_id = {}
+        self.n_resumed = 0
+        self.templates_to_update = []
+        self.not_updated_template_ids = set()
+        self.n_templates_by_state = {'new': 0, 'changed': 0, 'unchanged': 0}
+        self.unchanged_template_ids = set()
         self.push_spec = push_spec
         self.dry_run = dry_run
-        self.warnings = []
-        self.errors = []
-        self.actions = []
+        # the listener, if any, is told about every warning, error and action as soon as it is added
+        self.push_log = create_push_log(push_spec)
+        self.warnings = self._create_reported_list('warning', listener)
+        self.errors = self._create_reported_list('error', listener)
+        self.actions = self._create_reported_list('action', listener)
+        self.import_levels = []
         self.stats = {}
 
     def push_configuration(self):
+        try:
+            if self.push_spec.get('plan', {}).get('apply'):
+                import_levels = self.load_plan()
+                with self.instrumentation.phase('local_scan'):
+                    reload_planned_templates(self.local_xlr, [import_levels])
+                return self.apply_plan(import_levels)
+            # find templates that were requested to be pushed
+            with self.instrumentation.phase('local_scan'):
+                templates_details = self.local_xlr.get_templates_to_push(self.is_unchanged if self.manifest else None)
+            return self.push_templates(templates_details)
+        finally:
+            self.local_xlr.close()
+            self.close()
+
+    def close(self):
+        self.remote_xlr.close()
+        self.journal.close()
+        if self.push_log:
+            self.push_log.close()
+
+    def _create_reported_list(self, item_type, listener):
+        if self.push_log:
+            return SpooledList(item_type, listener, self.push_log,
+                               self.push_spec['spool'].get('maxItems', DEFAULT_MAX_ITEMS))
+        return ReportedList(item_type, listener)
+
+    def print_versions(self):
         source_xlr = self.local_xlr.get_local_xlr_details()
         target_xlr = self.remote_xlr.get_xlr_details()
         print('Going to push configuration from XL Release %s (%s) to XL Release %s (%s)' % (
             source_xlr['version'], source_xlr['url'], target_xlr['version'], target_xlr['url']
         ))
 
-        # find templates that were requested to be pushed
-        templates_details = self.local_xlr.get_templates_to_push()
-        n_local_templates = len(templates_details)
+    def push_templates(self, templates_details):
+        """Pushes the templates found by the local instance."""
+        self.print_versions()
+        # the local instance skips only the templates which are unchanged for all targets
+        templates_details = [t for t in templates_details if t['id'] not in self.unchanged_template_ids]
+        discovered_templates_details = templates_details
+        if self.journal.resume:
+            templates_details = self.skip_imported_before(templates_details)
+        n_local_templates = self.local_xlr.stats['n_matched_templates']
 
-        self.apply_folder_renamings(templates_details)
-        self.apply_configuration_renamings(templates_details)
+        graph = ReferenceGraph(templates_details)
+        self.apply_folder_renamings(graph)
+        self.apply_configuration_renamings(graph)
 
         # find corresponding remote entities
-        self.find_and_apply_remote_folder_ids(templates_details)
-        self.find_and_apply_remote_template_ids(templates_details)
-        self.find_and_apply_remote_configuration_ids(templates_details)
-
-        # check if all folders are present on the target instance
-        templates_details = self.filter_by_present_remote_folder(templates_details)
-        n_with_remote_folder = len(templates_details)
-
-        # check if all configurations are present on the target instance,
-        self.report_missing_configurations(templates_details)
-
-        # check for templates already present on the target system,
-        templates_details = self.filter_by_absent_templates(templates_details)
-        n_not_existing_remotely = len(templates_details)
-
-        # check if all referenced CreateReleaseTask templates are present on the
-        # target instance or are going to be pushed
-        self.report_missing_referenced_templates(templates_details)
+        with self.instrumentation.phase('remote_lookups'):
+            if self.remote_xlr.use_index and templates_details:
+                self.remote_xlr.build_index()
+            self.find_and_apply_remote_folder_ids(graph)
+            self.find_and_apply_remote_template_ids(graph)
+            self.refresh_remote_template_ids(graph)
+            self.find_and_apply_remote_configuration_ids(graph)
+
+        with self.instrumentation.phase('checks'):
+            # check if all folders are present on the target instance
+            self.filter_by_present_remote_folder(graph)
+            n_with_remote_folder = len(graph.get_templates())
+
+            # check if all configurations are present on the target instance,
+            self.report_missing_configurations(graph)
+
+            # check for templates already present on the target system,
+            self.filter_by_absent_templates(graph)
+            templates_details = graph.get_templates()
+            n_not_existing_remotely = len(templates_details)
+
+            # check if all referenced CreateReleaseTask templates are present on the
+            # target instance or are going to be pushed
+            self.report_missing_referenced_templates(graph)
 
         # sort templates first-dependent-then-depending order
-        TopologicalSorter(templates_details, self.warnings).sort()
+        with self.instrumentation.phase('sorting'):
+            self.import_levels = TopologicalSorter(templates_details, self.warnings).sort()
+
+        self.add_import_actions(templates_details)
 
+        self.stats = {
+            'n_scanned_templates': self.local_xlr.stats['n_scanned_templates'],
+            'n_matched_templates': n_local_templates,
+            'n_with_remote_folder': n_with_remote_folder,
+            'n_not_existing_remotely': n_not_existing_remotely
+        }
+        if self.manifest:
+            for state, n_templates in self.n_templates_by_state.items():
+                self.stats['n_%s' % state] = n_templates
+        return self.execute_and_get_result(discovered_templates_details, n_local_templates)
+
+    def apply_plan(self, import_levels):
+        """Imports the templates of a plan saved by a dry run, after checking that their remote folders
+        still have the planned IDs. The templates have to be stored by the local instance already."""
+        self.print_versions()
+        templates_details = [t for level in import_levels for t in level]
+        with self.instrumentation.phase('remote_lookups'):
+            self.check_planned_folder_ids(templates_details)
+        if self.journal.resume:
+            remaining_ids = set([t['id'] for t in self.skip_imported_before(templates_details)])
+            import_levels = [[t for t in level if t['id'] in remaining_ids] for level in import_levels]
+        self.import_levels = [level for level in import_levels if level]
+        self.add_import_actions([t for level in self.import_levels for t in level])
+        self.stats = {'n_planned_templates': len(templates_details)}
+        return self.execute_and_get_result(templates_details, len(templates_details))
+
+    def load_plan(self):
+        url = self.remote_xlr.server['url']
+        return load_plan(get_plan_file(self.push_spec, self.push_spec['plan']['apply'], url), self.push_spec, url)
+
+    def check_planned_folder_ids(self, templates_details):
+        planned_folder_ids_by_path = dict([(get_parent(t['remote_path']), t['remote_folder_id'])
+                                           for t in templates_details if get_parent(t['remote_path'])])
+        folder_ids_by_path = self.remote_xlr.get_folder_ids_by_paths(planned_folder_ids_by_path.keys())
+        changed_paths = [path for path, folder_id in planned_folder_ids_by_path.items()
+                         if folder_ids_by_path[path] != folder_id]
+        if changed_paths:
+            raise Exception('Cannot apply the plan as remote folders %s have been changed since it was made, '
+                            'make it again with a dry run' % sorted(changed_paths))
+
+    def add_import_actions(self, templates_details):
         for template in templates_details:
             self.actions.append({
                 'type': 'import',
@@ -66,68 +268,129 @@ class ConfigurationPusher:
                 'entity': template
             })
 
-        # import templates one by one, rewriting JSONs with new imported IDs
-        self.stats = {
-            'n_matched_templates': n_local_templates,
-            'n_with_remote_folder': n_with_remote_folder,
-            'n_not_existing_remotely': n_not_existing_remotely
-        }
+    def execute_and_get_result(self, templates_details, n_local_templates):
+        """Imports the templates of the import levels in batches, rewriting JSONs with new imported IDs,
+        unless it's a dry run, in which case the plan may be saved instead."""
+        if self.journal.resume:
+            self.stats['n_resumed'] = self.n_resumed
         if not self.dry_run:
-            print('Prepared the execution plan of %d actions, start executing' % len(self.actions))
-            self.execute_actions()
+            print('Prepared the execution plan of %d actions, start executing' % self.actions.n_items)
+            with self.instrumentation.phase('import'):
+                self.execute_actions()
             print('Finished the execution, pushed %d templates to the remote instance out of %d matched local ones' %
                   (self.stats['n_imported'], n_local_templates))
+        if self.templates_to_update:
+            with self.instrumentation.phase('update'):
+                self.update_templates()
+        if not self.dry_run:
+            if self.manifest:
+                self.update_manifest(templates_details)
         else:
-            print('Skipping execution of %d actions as it is dry run' % len(self.actions))
-
+            print('Skipping execution of %d actions as it is dry run' % self.actions.n_items)
+            if self.push_spec.get('plan', {}).get('save'):
+                self.stats['plan_file'] = get_plan_file(self.push_spec, self.push_spec['plan']['save'],
+                                                        self.remote_xlr.server['url'])
+                save_plan(self.stats['plan_file'], self.push_spec, self.remote_xlr.server['url'], self.import_levels)
+        self.stats.update(self.remote_xlr.get_stats())
+        cache_stats = [self.local_xlr.cache_store.get_stats(), self.remote_xlr.cache_store.get_stats()]
+        for key in cache_stats[0]:
+            self.stats[key] = sum([stats[key] for stats in cache_stats])
+        n_cache_lookups = self.stats['n_cache_hits'] + self.stats['n_cache_misses']
+        self.stats['cache_hit_rate'] = round(float(self.stats['n_cache_hits']) / n_cache_lookups, 3) \
+            if n_cache_lookups else None
+        self.stats.update(self.get_instrumentation_stats())
+        if self.push_spec.get('instrumentation', {}).get('log', False):
+            log_stats(self.stats)
+        return self.get_result()
+
+    def get_instrumentation_stats(self):
+        """Returns the phase timings and the call statistics of the local and the remote instance."""
+        if self.local_xlr.instrumentation is self.instrumentation:
+            return self.instrumentation.get_stats()
+        return merge_stats([self.local_xlr.instrumentation.get_stats(), self.instrumentation.get_stats()])
+
+    def get_result(self):
+        stats = self.stats
+        if self.push_log:
+            # the result has only the first items, the log file has all of them
+            stats = dict(stats, log_file=self.push_log.file_name, n_actions=self.actions.n_items,
+                         n_warnings=self.warnings.n_items, n_errors=self.errors.n_items)
         return {
             # 'debug_template_details': templates_details
             'warnings': self.warnings,
             'errors': self.errors,
             'actions': self.actions,
-            'stats': self.stats,
+            'stats': stats,
         }
 
-    def _all_templates(self, templates_details):
-        return templates_details + [ref for t in templates_details for ref in t['referenced_templates']]
-
-    def apply_folder_renamings(self, templates_details):
-        renamings = self.push_spec.get('folders', {}).get('rename', {})
-        for template in self._all_templates(templates_details):
-            local_path = template['path']
-            remote_path = local_path
-            for pattern_to_rename in renamings:
-                pattern = '^' + pattern_to_rename
-                if re.match(pattern, local_path):
-                    remote_path = re.sub(pattern, renamings[pattern_to_rename], local_path)
-                    break  # don't go through several renamings
-            template['remote_path'] = remote_path
-
-    def apply_configuration_renamings(self, templates_details):
-        configs = [config for t in templates_details for config in t['referenced_configurations']]
+    def is_unchanged(self, template_details):
+        if not self.manifest:
+            return False
+        state = self.manifest.get_state(template_details['id'], template_details['hash'])
+        self.n_templates_by_state[state] += 1
+        if state == 'unchanged':
+            self.unchanged_template_ids.add(template_details['id'])
+        return state == 'unchanged'
+
+    def update_manifest(self, templates_details):
+        # templates which failed or could not be pushed or updated are checked again by the next run
+        for template in templates_details:
+            if template.get('remote_template_id', None) and template['id'] not in self.not_updated_template_ids:
+                self.manifest.put(template['id'], template['hash'], template['remote_template_id'])
+        self.manifest.save()
+
+    def skip_imported_before(self, templates_details):
+        """Returns the templates which have not been imported by the interrupted push with the same content.
+        The remote IDs of the imported ones are kept, so that the references to them are rewritten."""
+        remaining = []
+        for template in templates_details:
+            remote_id = self.journal.get_remote_id(template['id'], template['hash'])
+            if not remote_id:
+                remaining.append(template)
+                continue
+            template['remote_template_id'] = remote_id
+            self.template_id_to_imported_id[template['id']] = remote_id
+            self.n_resumed += 1
+            self.actions.append({
+                'type': 'noop',
+                'description': 'Template [%s](%s) has been imported by the interrupted push as [%s]' % (
+                    template['path'], template['id'], remote_id)
+            })
+        return remaining
+
+    def apply_folder_renamings(self, graph):
+        spec = compile_spec(self.push_spec)
+        for template in graph.get_templates_and_references():
+            template['remote_path'] = spec.get_remote_path(template['path'])
+
+    def apply_configuration_renamings(self, graph):
         renamings = self.push_spec.get('configurations', {}).get('rename', {})
-        for config in configs:
+        for config in graph.get_configurations():
             title = config['title']
             remote_title = renamings.get('%s/%s' % ((config['type']), title), title)
             config['remote_title'] = remote_title
 
-    def find_and_apply_remote_folder_ids(self, templates_details):
-        remote_folder_paths = set([get_parent(t['remote_path'])
-                                   for t in self._all_templates(templates_details)
-                                   if get_parent(t['remote_path'])])
-        folder_ids_by_path = dict(map(
-            lambda path: (path, self.remote_xlr.get_folder_id_by_path(path)),
-            remote_folder_paths
-        ))
-        for template in self._all_templates(templates_details):
+    def find_and_apply_remote_folder_ids(self, graph):
+        templates = graph.get_templates_and_references()
+        remote_folder_paths = set([get_parent(t['remote_path']) for t in templates if get_parent(t['remote_path'])])
+        folder_ids_by_path = self.remote_xlr.get_folder_ids_by_paths(remote_folder_paths)
+        for template in templates:
             folder_path = get_parent(template['remote_path'])
             if folder_path:
                 template['remote_folder_id'] = folder_ids_by_path[folder_path]
             else:
                 template['remote_folder_id'] = 'Applications'
 
-    def find_and_apply_remote_template_ids(self, templates_details):
-        for template in self._all_templates(templates_details):
+    def find_and_apply_remote_template_ids(self, graph):
+        templates = graph.get_templates_and_references()
+        # templates imported by the interrupted push are not looked up again
+        self.remote_xlr.load_folders_templates([t['remote_folder_id'] for t in templates
+                                                if t.get('remote_folder_id', None) and
+                                                t['id'] not in self.template_id_to_imported_id], self.warnings)
+        for template in templates:
+            if template['id'] in self.template_id_to_imported_id:
+                template['remote_template_id'] = self.template_id_to_imported_id[template['id']]
+                continue
             remote_template_id = None
             if template.get('remote_folder_id', None):
                 title = get_name(template['remote_path'])
@@ -135,151 +398,568 @@ class ConfigurationPusher:
                     template['remote_folder_id'], title, self.warnings)
             template['remote_template_id'] = remote_template_id
 
-    def find_and_apply_remote_configuration_ids(self, templates_details):
-        all_configurations = [config for t in templates_details for config in t['referenced_configurations']]
-        unique_configurations = dict([(config['id'], config) for config in all_configurations])
-        remote_configurations = {}
-        for local_config_id, config in unique_configurations.items():
-            remote_config_id = self.remote_xlr.get_configuration_id_by_type_and_title(
-                config['type'], config['remote_title'], self.warnings)
-            remote_configurations[local_config_id] = remote_config_id
+    def refresh_remote_template_ids(self, graph):
+        # templates absent from the listings cached by a previous run may have been created since then,
+        # so list the folders which are going to be imported to again
+        folder_ids = self.remote_xlr.get_folder_ids_listed_before(
+            [t['remote_folder_id'] for t in graph.get_templates_and_references()
+             if t.get('remote_folder_id', None) and not t['remote_template_id']])
+        if folder_ids:
+            for folder_id in folder_ids:
+                self.remote_xlr.forget_folder_templates(folder_id)
+            self.find_and_apply_remote_template_ids(graph)
+
+    def find_and_apply_remote_configuration_ids(self, graph):
+        all_configurations = graph.get_configurations()
+        remote_configurations = self.remote_xlr.get_configuration_ids_by_types_and_titles(
+            [(config['type'], config['remote_title']) for config in all_configurations], self.warnings)
         for config in all_configurations:
-            config['remote_configuration_id'] = remote_configurations[config['id']]
+            config['remote_configuration_id'] = remote_configurations[(config['type'], config['remote_title'])]
 
-    def filter_by_present_remote_folder(self, templates_details):
-        templates_with_no_remote_folder = filter(lambda t: not t['remote_folder_id'], templates_details)
+    def filter_by_present_remote_folder(self, graph):
+        # keep only the templates with a present remote folder
+        templates_with_no_remote_folder = graph.remove(lambda t: not t['remote_folder_id'])
         missing_templates_count_by_path = {}
-        for path, templates in groupby(templates_with_no_remote_folder, lambda t: get_parent(t['remote_path'])):
-            missing_templates_count_by_path[path] = len(list(templates))
-        missing_paths = missing_templates_count_by_path.keys()
-        missing_paths.sort()
-        for path in missing_paths:
+        for template in templates_with_no_remote_folder:
+            path = get_parent(template['remote_path'])
+            missing_templates_count_by_path[path] = missing_templates_count_by_path.get(path, 0) + 1
+        for path in sorted(missing_templates_count_by_path):
             self.errors.append('Missing remote folder [%s] for %d matching templates' %
-                               (path, missing_templates_count_by_path.get(path, 0)))
-        # return only the present ones
-        return filter(lambda t: t['remote_folder_id'], templates_details)
-
-    def report_missing_configurations(self, templates_details):
-        all_configurations = [config for t in templates_details for config in t['referenced_configurations']]
-        missing_configurations = dict([(config['id'], config)
-                                       for config in all_configurations
-                                       if not config['remote_configuration_id']])
-        for local_id, config in missing_configurations.items():
-            self.warnings.append('Missing remote configuration by type [%s] and title [%s]' %
-                                 (config['type'], config['title']))
-
-    def filter_by_absent_templates(self, templates_details):
-        for template in templates_details:
-            if template['remote_template_id']:
-                self.actions.append({
-                    'type': 'noop',
-                    'description': 'Template [%s](%s) already exists on the remote instance: [%s](%s)' % (
-                        template['path'], template['id'], template['remote_path'], template['remote_template_id'])
-                })
-        # return only non-existing ones
-        return filter(lambda t: not t['remote_template_id'], templates_details)
-
-    def report_missing_referenced_templates(self, templates_details):
-        pushed_template_ids = set(t['id'] for t in templates_details)
-        referenced_templates_by_ids = dict([(ref['id'], ref)
-                                            for t in templates_details
-                                            for ref in t['referenced_templates']])
-        external_missing_templates = [t for t_id, t in referenced_templates_by_ids.items()
-                                      if not t['remote_template_id'] and t_id not in pushed_template_ids]
-        for missing in external_missing_templates:
-            templates_using_it = [t for t in templates_details
-                                  if missing['id'] in
-                                  [ref['id'] for ref in t['referenced_templates']]]
+                               (path, missing_templates_count_by_path[path]))
+
+    def report_missing_configurations(self, graph):
+        for config_id, config in graph.get_configurations_by_id():
+            if not config['remote_configuration_id']:
+                self.warnings.append('Missing remote configuration by type [%s] and title [%s]' %
+                                     (config['type'], config['title']))
+
+    def filter_by_absent_templates(self, graph):
+        # keep only the templates which don't exist remotely, the existing ones are updated after the import if enabled
+        update = self.push_spec['templates'].get('update', False)
+        for template in graph.remove(lambda t: t['remote_template_id']):
+            if update:
+                self.templates_to_update.append(template)
+                continue
+            self.actions.append({
+                'type': 'noop',
+                'description': 'Template [%s](%s) already exists on the remote instance: [%s](%s)' % (
+                    template['path'], template['id'], template['remote_path'], template['remote_template_id'])
+            })
+
+    def report_missing_referenced_templates(self, graph):
+        for missing, templates_using_it in graph.get_missing_referenced_templates():
             self.warnings.append('Missing remote template [%s] referenced from %d local templates: %s' % (
                 missing['remote_path'], len(templates_using_it), [t['path'] for t in templates_using_it]
             ))
 
     def execute_actions(self):
-        template_id_to_imported_id = {}
-        n_imported = 0
-        n_failed_import = 0
-        for action in self.actions:
-            if action['type'] == 'noop':
-                continue
-            if action['type'] == 'import':
-                template_details = action['entity']
-                # fill in referenced template remote id if needed
-                for ref in template_details['referenced_templates']:
-                    if not ref['remote_template_id']:
-                        ref['remote_template_id'] = template_id_to_imported_id.get(ref['id'], None)
-                try:
-                    imported_id = self.import_template(template_details)
-                    template_id_to_imported_id[template_details['id']] = imported_id
-                    template_details['remote_template_id'] = imported_id
-                    n_imported += 1
-                except Exception as e:
-                    self.errors.append('Could not import template [%s](%s): %s' % (
-                        template_details['path'], template_details['id'], e))
-                    n_failed_import += 1
-
-        self.stats['n_imported'] = n_imported
-        self.stats['n_failed_import'] = n_failed_import
-
-    def import_template(self, template_details):
-        template = self.local_xlr.get_template(template_details['id'])
-        self.local_xlr.strip_attachments_and_warn(template, self.warnings)
-        self.local_xlr.check_triggers_and_warn(template, self.warnings)
-        template_json = self.local_xlr.to_json(template)
-
-        def replace_ids(t_json, local_id, remote_id):
-            return t_json.replace('"%s"' % local_id, '"%s"' % remote_id)
-
-        # rewrite configuration IDs
-        for config in template_details['referenced_configurations']:
-            if config['remote_configuration_id']:
-                template_json = replace_ids(template_json, config['id'], config['remote_configuration_id'])
-        # rewrite referenced template IDs
+        self.journal.open()
+        self.stats['n_imported'] = 0
+        self.stats['n_failed_import'] = 0
+        self.stats['n_import_requests'] = 0
+        self.stats['n_import_retries'] = 0
+        self.stats['n_rewritten_references'] = 0
+        import_latencies = []
+        concurrency = self.push_spec.get('import', {}).get('concurrency', DEFAULT_IMPORT_CONCURRENCY)
+        # templates of the same level don't depend on each other, so they can be imported together
+        for level in self.import_levels:
+            folder_ids = []
+            templates_by_folder_id = {}
+            for template in level:
+                if template['remote_folder_id'] not in templates_by_folder_id:
+                    folder_ids.append(template['remote_folder_id'])
+                templates_by_folder_id.setdefault(template['remote_folder_id'], []).append(template)
+            # the templates of a folder are imported by one thread, so that a failed batch is never checked
+            # while another batch is being imported to the same folder
+            results = parallel_map(lambda folder_id: self._import_folder_templates(templates_by_folder_id[folder_id]),
+                                   folder_ids, concurrency)
+            # the results are applied in the order of the folders, so that they don't depend on the timing
+            for result in results:
+                self._apply_import_result(result)
+                import_latencies.extend(result.latencies)
+        self.stats.update(_get_latency_percentiles('import_latency', import_latencies))
+
+    def _import_folder_templates(self, templates_details):
+        result = ImportResult()
+        for batch in self._get_import_batches(templates_details, result):
+            self._import_batch(batch, result)
+        return result
+
+    def _apply_import_result(self, result):
+        for template, imported_id in result.imported:
+            self._set_imported_id(template, imported_id)
+        self.warnings.extend(result.warnings)
+        self.errors.extend(result.errors)
+        for key in ['n_failed_import', 'n_import_requests', 'n_import_retries', 'n_rewritten_references']:
+            self.stats[key] += getattr(result, key)
+
+    def _get_import_batches(self, templates_details, result):
+        """Yields lists of (template details, template JSON) of templates going to the same remote folder,
+        limited by the configured batch size and total JSON length."""
+        import_spec = self.push_spec.get('import', {})
+        batch_size = import_spec.get('batchSize', DEFAULT_IMPORT_BATCH_SIZE)
+        batch_bytes = import_spec.get('batchBytes', DEFAULT_IMPORT_BATCH_BYTES)
+        batch = []
+        n_batch_bytes = 0
+        for template in templates_details:
+            template_json = self.prepare_template_json(template, result)
+            n_template_bytes = _utf8_length(template_json)
+            if batch and (len(batch) >= batch_size or n_batch_bytes + n_template_bytes > batch_bytes):
+                yield batch
+                batch = []
+                n_batch_bytes = 0
+            batch.append((template, template_json))
+            n_batch_bytes += n_template_bytes
+        if batch:
+            yield batch
+
+    def _import_batch(self, batch, result, refresh_folder_id=True, attempt=0):
+        folder_id = batch[0][0]['remote_folder_id']
+        try:
+            imported_ids = self._send_import_request(folder_id, batch, result)
+        except Exception as e:
+            if isinstance(e, RemoteRequestError) and e.status == 404 and refresh_folder_id and \
+                    self._refresh_remote_folder_id(batch):
+                self._import_batch(batch, result, refresh_folder_id=False, attempt=attempt)
+                return
+            if isinstance(e, RemoteRequestError) and e.is_retryable():
+                if attempt < self.push_spec.get('import', {}).get('retries', DEFAULT_IMPORT_RETRIES):
+                    result.n_import_retries += 1
+                    time.sleep(get_backoff_delay(attempt, self.push_spec.get('import', {}).get(
+                        'retryDelaySeconds', DEFAULT_IMPORT_RETRY_DELAY)))
+                    # a rejected request imports nothing, otherwise the templates might have been imported anyway
+                    remaining = batch if e.is_rejected() else self._check_imported_anyway(folder_id, batch, e, result)
+                    if remaining:
+                        self._import_batch(remaining, result, refresh_folder_id, attempt + 1)
+                    return
+                # the remote instance is unavailable, so splitting the batch would not help
+                remaining = batch if e.is_rejected() else self._check_imported_anyway(folder_id, batch, e, result)
+                for template, template_json in remaining or []:
+                    self._add_import_error(template, e, result)
+                return
+            if len(batch) == 1:
+                self._add_import_error(batch[0][0], e, result)
+                return
+            remaining = self._check_imported_anyway(folder_id, batch, e, result)
+            # retry the halves separately, so that one bad template doesn't fail the others
+            middle = (len(remaining or []) + 1) // 2
+            for half in [(remaining or [])[:middle], (remaining or [])[middle:]]:
+                if half:
+                    self._import_batch(half, result)
+            return
+        self._add_imported([(template, imported_id)
+                            for (template, template_json), imported_id in zip(batch, imported_ids)], result)
+
+    def _add_imported(self, imported, result):
+        # the journal is written right away, so that an interrupted push can be resumed after the imported batches
+        result.imported.extend(imported)
+        self.journal.record(imported)
+
+    def _send_import_request(self, folder_id, batch, result):
+        result.n_import_requests += 1
+        start_time = time.time()
+        try:
+            return self.remote_xlr.import_templates(
+                folder_id, [(template_json, template['path']) for template, template_json in batch], result.warnings)
+        finally:
+            result.latencies.append(time.time() - start_time)
+
+    def _add_import_error(self, template, error, result):
+        result.errors.append('Could not import template [%s](%s): %s' % (template['path'], template['id'], error))
+        result.n_failed_import += 1
+
+    def _check_imported_anyway(self, folder_id, batch, error, result):
+        """Returns the templates of a failed batch which still have to be imported,
+        or None if that could not be checked, in which case they are all reported as failed."""
+        try:
+            return self._skip_imported_anyway(folder_id, batch, result)
+        except Exception as check_error:
+            for template, template_json in batch:
+                result.errors.append('Could not import template [%s](%s): %s. Could not check if it has been '
+                                     'imported anyway: %s' % (template['path'], template['id'], error, check_error))
+                result.n_failed_import += 1
+            return None
+
+    def _refresh_remote_folder_id(self, batch):
+        """Looks up the remote folder of the batch again, as the cached folder ID may be stale.
+        Returns True if the folder has got a new ID."""
+        folder_path = get_parent(batch[0][0]['remote_path'])
+        if not folder_path:
+            return False
+        self.remote_xlr.forget_folder_id(folder_path)
+        folder_id = self.remote_xlr.get_folder_id_by_path(folder_path)
+        if not folder_id or folder_id == batch[0][0]['remote_folder_id']:
+            return False
+        print('Remote folder [%s] has got a new ID [%s], importing to it again' % (folder_path, folder_id))
+        for template, template_json in batch:
+            template['remote_folder_id'] = folder_id
+        return True
+
+    def _skip_imported_anyway(self, folder_id, batch, result):
+        """Finds templates of a failed batch which appeared in the remote folder nevertheless, and returns the
+        others. Pushed templates were absent from the folder before, so a template with the same title and an ID
+        that was not imported by this push must be a result of the batch."""
+        self.remote_xlr.forget_folder_templates(folder_id)
+        known_ids = set(self.template_id_to_imported_id.values())
+        known_ids.update([imported_id for template, imported_id in result.imported])
+        new_ids_by_title = {}
+        for remote_template in self.remote_xlr.list_folder_templates(folder_id):
+            if remote_template['id'] not in known_ids:
+                new_ids_by_title.setdefault(remote_template['title'], []).append(remote_template['id'])
+        n_templates_by_title = {}
+        for template, template_json in batch:
+            title = get_name(template['remote_path'])
+            n_templates_by_title[title] = n_templates_by_title.get(title, 0) + 1
+
+        remaining = []
+        imported = []
+        for template, template_json in batch:
+            title = get_name(template['remote_path'])
+            new_ids = new_ids_by_title.get(title, [])
+            if not new_ids:
+                remaining.append((template, template_json))
+            elif len(new_ids) == 1 and n_templates_by_title[title] == 1:
+                imported.append((template, new_ids[0]))
+            else:
+                result.errors.append('Could not tell which of remote templates %s in folder [%s] is the import of '
+                                     'template [%s](%s), check them manually' %
+                                     (new_ids, folder_id, template['path'], template['id']))
+                result.n_failed_import += 1
+        if imported:
+            self._add_imported(imported, result)
+        return remaining
+
+    def update_templates(self):
+        """Compares the templates which exist on the remote instance with the local ones, and updates only their
+        changed properties, phases, tasks and variables, or just reports them in a dry run. It runs after the
+        import, so that the references to the imported templates are rewritten to their remote IDs."""
+        for key in ['n_identical_remotely', 'n_outdated_remotely', 'n_not_updatable', 'n_failed_update']:
+            self.stats[key] = 0
+        if not self.dry_run:
+            self.stats['n_updated'] = 0
+            self.stats['n_update_requests'] = 0
+        concurrency = self.push_spec.get('import', {}).get('concurrency', DEFAULT_IMPORT_CONCURRENCY)
+        results = parallel_map(self._update_template, self.templates_to_update, concurrency)
+        # the results are applied in the order of the templates, so that they don't depend on the timing
+        for template, result in zip(self.templates_to_update, results):
+            self._apply_update_result(template, result)
+
+    def _update_template(self, template_details):
+        result = UpdateResult()
+        try:
+            template_json = self.prepare_template_json(template_details, result)
+            remote_template = self.remote_xlr.get_template(template_details['remote_template_id'])
+            # the local template is compared after rewriting its own IDs and those of its parts to the remote ones
+            local_ids_to_remote = match_template_ids(json.loads(template_json), remote_template)
+            local_template = json.loads(IdRewriter(local_ids_to_remote).rewrite(template_json))
+            result.updates = get_template_updates(local_template, remote_template)
+            if not self.dry_run:
+                for kind, ci in result.updates:
+                    result.n_update_requests += 1
+                    self.remote_xlr.update_template_part(kind, ci)
+        except TemplateStructureChanged as e:
+            result.structure_change = e
+        except Exception as e:
+            result.error = e
+        return result
+
+    def _apply_update_result(self, template, result):
+        self.warnings.extend(result.warnings)
+        if not self.dry_run:
+            self.stats['n_rewritten_references'] += result.n_rewritten_references
+            self.stats['n_update_requests'] += result.n_update_requests
+        if result.structure_change:
+            self.not_updated_template_ids.add(template['id'])
+            self.stats['n_not_updatable'] += 1
+            self.warnings.append('Template [%s] cannot be updated in place as its remote counterpart [%s](%s) differs '
+                                 'in structure: %s. Delete the remote template to import it again' % (
+                                     template['path'], template['remote_path'], template['remote_template_id'],
+                                     result.structure_change))
+            return
+        if result.updates:
+            self.stats['n_outdated_remotely'] += 1
+            self.actions.append({
+                'type': 'update',
+                'description': 'Update %s of template [%s] on the remote instance: [%s](%s)' % (
+                    _describe_updates(result.updates), template['path'], template['remote_path'],
+                    template['remote_template_id']),
+                'entity': template
+            })
+        elif not result.error:
+            self.stats['n_identical_remotely'] += 1
+            self.actions.append({
+                'type': 'noop',
+                'description': 'Template [%s](%s) is identical to the remote one: [%s](%s)' % (
+                    template['path'], template['id'], template['remote_path'], template['remote_template_id'])
+            })
+        if result.error:
+            self.not_updated_template_ids.add(template['id'])
+            self.stats['n_failed_update'] += 1
+            if result.n_update_requests:
+                # the last request has failed
+                self.errors.append('Could not update template [%s](%s), %d of %d changed parts were updated: %s' % (
+                    template['path'], template['id'], result.n_update_requests - 1, len(result.updates),
+                    result.error))
+            else:
+                self.errors.append('Could not update template [%s](%s): %s' % (
+                    template['path'], template['id'], result.error))
+        elif result.updates and not self.dry_run:
+            self.stats['n_updated'] += 1
+
+    def _set_imported_id(self, template_details, imported_id):
+        self.template_id_to_imported_id[template_details['id']] = imported_id
+        template_details['remote_template_id'] = imported_id
+        self.remote_xlr.add_imported_template(template_details['remote_folder_id'],
+                                              get_name(template_details['remote_path']), imported_id)
+        self.stats['n_imported'] += 1
+
+    def prepare_template_json(self, template_details, result):
+        # fill in referenced template remote id if needed, the referenced templates of previous levels are imported
         for ref in template_details['referenced_templates']:
-            if ref['remote_template_id']:
-                template_json = replace_ids(template_json, ref['id'], ref['remote_template_id'])
+            if not ref['remote_template_id']:
+                ref['remote_template_id'] = self.template_id_to_imported_id.get(ref['id'], None)
+
+        # the template has been serialised without attachments during the discovery
+        result.warnings.extend(self.local_xlr.payloads.get_warnings(template_details['id']))
+        template_json = self.local_xlr.payloads.get(template_details['id'])
+
+        # rewrite configuration and referenced template IDs
+        local_to_remote_ids = dict([(config['id'], config['remote_configuration_id'])
+                                    for config in template_details['referenced_configurations']] +
+                                   [(ref['id'], ref['remote_template_id'])
+                                    for ref in template_details['referenced_templates']])
+        rewriter = IdRewriter(local_to_remote_ids)
+        template_json = rewriter.rewrite(template_json)
+        self._report_not_rewritten_ids(template_details, rewriter, result.warnings)
+        result.n_rewritten_references += rewriter.get_number_of_replacements()
+        return template_json
+
+    def _report_not_rewritten_ids(self, template_details, rewriter, warnings):
+        kept_ids = sorted(rewriter.get_kept_ids())
+        if kept_ids:
+            warnings.append('Template [%s] keeps %d references to entities of the source instance that are '
+                            'missing on the remote instance, fix them manually: %s' %
+                            (template_details['path'], len(kept_ids), kept_ids))
+        unused_ids = sorted(rewriter.get_unused_ids())
+        if unused_ids:
+            warnings.append('Could not find references to %s in the JSON of template [%s], so they were not '
+                            'rewritten to the remote IDs' % (unused_ids, template_details['path']))
+
+
+class ReportedList(list):
+    """List which calls listener(item_type, item) for every added item."""
+
+    def __init__(self, item_type, listener):
+        list.__init__(self)
+        self.item_type = item_type
+        self.listener = listener
+        self.n_items = 0
+
+    def append(self, item):
+        list.append(self, item)
+        self.n_items += 1
+        if self.listener:
+            self.listener(self.item_type, item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+
+class SpooledList(ReportedList):
+    """ReportedList which writes every added item to the push log, and keeps only the first max_items in memory."""
+
+    def __init__(self, item_type, listener, push_log, max_items):
+        ReportedList.__init__(self, item_type, listener)
+        self.push_log = push_log
+        self.max_items = max_items
+
+    def append(self, item):
+        self.push_log.write(self.item_type, item)
+        if len(self) < self.max_items:
+            list.append(self, item)
+        self.n_items += 1
+        if self.listener:
+            self.listener(self.item_type, item)
+
+
+class ImportResult:
+    """Outcome of importing the templates of one remote folder. It is collected separately for every folder,
+    so that several folders can be imported at the same time."""
+
+    def __init__(self):
+        self.imported = []  # (template details, imported template ID)
+        self.warnings = []
+        self.errors = []
+        self.latencies = []  # of every import request, in seconds
+        self.n_failed_import = 0
+        self.n_import_requests = 0
+        self.n_import_retries = 0
+        self.n_rewritten_references = 0
+
 
-        imported_id = self.remote_xlr.import_template(template_details['remote_folder_id'], template_json,
-                                                      template_details['path'], self.warnings)
-        return imported_id
+class UpdateResult:
+    """Outcome of comparing one template with its remote counterpart and updating its changed parts."""
+
+    def __init__(self):
+        self.updates = []  # (kind, remote CI) of the changed parts, in the order of the template
+        self.warnings = []
+        self.structure_change = None
+        self.error = None
+        self.n_update_requests = 0
+        self.n_rewritten_references = 0
+
+
+def _describe_updates(updates):
+    n_updates_by_kind = {}
+    for kind, ci in updates:
+        n_updates_by_kind[kind] = n_updates_by_kind.get(kind, 0) + 1
+    parts = []
+    for kind in ['template', 'phase', 'task', 'variable']:
+        n_updates = n_updates_by_kind.get(kind, 0)
+        if kind == 'template' and n_updates:
+            parts.append('the properties')
+        elif n_updates:
+            parts.append('%d %s%s' % (n_updates, kind, 's' if n_updates > 1 else ''))
+    return ', '.join(parts)
+
+
+def _get_latency_percentiles(name, latencies):
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    percentiles = {}
+    for percentile in [50, 90, 99]:
+        # nearest-rank method
+        index = max(0, int(math.ceil(percentile / 100.0 * len(latencies))) - 1)
+        percentiles['%s_p%d_seconds' % (name, percentile)] = round(latencies[index], 3)
+    percentiles['%s_max_seconds' % name] = round(latencies[-1], 3)
+    return percentiles
+
+
+def _utf8_length(string):
+    if not isinstance(string, str):
+        string = string.encode('utf-8')
+    return len(string)
+
+
+class IdRewriter:
+    """Replaces the quoted local IDs in a JSON with their remote counterparts in a single scan,
+    counting the occurrences of every ID."""
+
+    # a JSON string, possibly with escaped characters
+    _JSON_STRING = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"')
+
+    def __init__(self, local_to_remote_ids):
+        self.local_to_remote_ids = local_to_remote_ids
+        self.counts = dict([(local_id, 0) for local_id in local_to_remote_ids])
+
+    def rewrite(self, json_string):
+        def replace(match):
+            local_id = match.group(1)
+            if local_id not in self.counts:
+                return match.group(0)
+            self.counts[local_id] += 1
+            remote_id = self.local_to_remote_ids[local_id]
+            return '"%s"' % remote_id if remote_id else match.group(0)
+
+        return self._JSON_STRING.sub(replace, json_string)
+
+    def get_number_of_replacements(self):
+        return sum([count for local_id, count in self.counts.items() if self.local_to_remote_ids[local_id]])
+
+    def get_kept_ids(self):
+        """Returns the local IDs found in the JSON which could not be rewritten as there's no remote ID for them."""
+        return [local_id for local_id, count in self.counts.items()
+                if count and not self.local_to_remote_ids[local_id]]
+
+    def get_unused_ids(self):
+        """Returns the local IDs with a known remote ID which were not found in the JSON."""
+        return [local_id for local_id, count in self.counts.items()
+                if not count and self.local_to_remote_ids[local_id]]
 
 
 class TopologicalSorter:
+    """Orders templates so that the templates referenced by CreateReleaseTasks go before the ones referencing them,
+    in time linear to the number of templates and references."""
+
     def __init__(self, templates_details, warnings):
         self.templates_details = templates_details
         self.warnings = warnings
 
     def sort(self):
+        """Sorts the templates in place and returns them grouped in levels: the templates of a level only depend
+        on the templates of the previous levels, so they can be imported together."""
         templates_by_ids = dict([(t['id'], t) for t in self.templates_details])
-        ordered_ids = []
+        children_ids_by_id = {}
+        for template in self.templates_details:
+            children_ids = []
+            for ref in template['referenced_templates']:
+                # external template references are skipped, they are not imported
+                if ref['id'] in templates_by_ids and ref['id'] not in children_ids:
+                    children_ids.append(ref['id'])
+            children_ids_by_id[template['id']] = children_ids
+
+        level_by_id = {}
+        levels = []
+        for component in self._get_strongly_connected_components(children_ids_by_id):
+            if len(component) > 1 or component[0] in children_ids_by_id[component[0]]:
+                self.warnings.append('There is a cycle of CreateReleaseTask dependencies between templates %s, '
+                                     'so you will have to restore the links manually after the configuration has '
+                                     'been pushed' % ', '.join(['[%s]' % t_id for t_id in reversed(component)]))
+            members = set(component)
+            level = max([level_by_id[child_id] + 1 for member_id in component
+                         for child_id in children_ids_by_id[member_id] if child_id not in members] or [0])
+            # the templates of a cycle go one after another, so that all links but one can be restored
+            for member_id in component:
+                level_by_id[member_id] = level
+                if level == len(levels):
+                    levels.append([])
+                levels[level].append(templates_by_ids[member_id])
+                level += 1
+
+        self.templates_details[:] = [template for level in levels for template in level]
+        return levels
+
+    def _get_strongly_connected_components(self, children_ids_by_id):
+        """Tarjan's algorithm with an explicit stack instead of recursion. The components are returned in
+        dependencies first order, and each one lists its dependencies first too."""
+        order = {}
+        lowlink = {}
         stack = []
-
-        for template_id in templates_by_ids:
-            if template_id in ordered_ids:
-                continue  # already visited by a previous DFS run
-            # Run DFS algorithm and push to ordered_ids when exiting a tree branch
-            visited = set()
-            stack.append(template_id)
-            while stack:
-                node_id = stack[-1]
-                children_ids = [t['id'] for t in templates_by_ids[node_id]['referenced_templates']]
-                children_to_visit = set(children_ids) - visited
-                if children_to_visit:
-                    child_id = next(iter(children_to_visit))
-                    if child_id in stack:
-                        # cycle detected
-                        self.warnings.append('There is a cycle CreateReleaseTask dependency between templates '
-                                             '[%s] and [%s], so you will have to restore the link manually after the '
-                                             'configuration has been pushed' % (node_id, child_id))
-                    elif child_id not in templates_by_ids:
-                        # encountered an external template reference, skipping
-                        visited.add(child_id)
-                    else:
+        on_stack = set()
+        components = []
+        for root_id in [t['id'] for t in self.templates_details]:
+            if root_id in order:
+                continue
+            order[root_id] = lowlink[root_id] = len(order)
+            stack.append(root_id)
+            on_stack.add(root_id)
+            path = [(root_id, iter(children_ids_by_id[root_id]))]
+            while path:
+                node_id, children_ids = path[-1]
+                child_id = next(children_ids, None)
+                if child_id is not None:
+                    if child_id not in order:
+                        order[child_id] = lowlink[child_id] = len(order)
                         stack.append(child_id)
-                else:
-                    # all children visited, go up the tree
-                    stack.pop()
-                    visited.add(node_id)
-                    ordered_ids.append(node_id)
-
-        # sort templates_details according to the topological order
-        self.templates_details.sort(key=lambda template: ordered_ids.index(template['id']))
+                        on_stack.add(child_id)
+                        path.append((child_id, iter(children_ids_by_id[child_id])))
+                    elif child_id in on_stack:
+                        lowlink[node_id] = min(lowlink[node_id], order[child_id])
+                    continue
+                # all children visited, go up the tree
+                path.pop()
+                if path:
+                    parent_id = path[-1][0]
+                    lowlink[parent_id] = min(lowlink[parent_id], lowlink[node_id])
+                if lowlink[node_id] == order[node_id]:
+                    component = []
+                    while True:
+                        member_id = stack.pop()
+                        on_stack.discard(member_id)
+                        component.append(member_id)
+                        if member_id == node_id:
+                            break
+                    components.append(component)
+        return components
@@ -0,0 +1,304 @@
+import base64
+import gzip
+import hashlib
+import httplib
+import io
+import socket
+import threading
+import time
+import urlparse
+
+
+# Requests which can be safely sent again when a pooled connection turns out to be closed by the server
+IDEMPOTENT_METHODS = ['GET', 'PUT', 'DELETE']
+
+# Seconds after which an idle connection is not reused, as the server might have closed it
+DEFAULT_KEEP_ALIVE = 5
+
+# Bytes of a streamed request body, after compression, collected before they are sent at once, as many small
+# writes would be delayed by the interaction of the Nagle algorithm with delayed acknowledgements
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class HttpSessionResponse:
+    """Response of an HttpSession request, with the same interface as the one of xlrelease.HttpRequest."""
+
+    def __init__(self, status, response):
+        self.status = status
+        self.response = response
+
+    def getStatus(self):
+        return self.status
+
+    def isSuccessful(self):
+        return 200 <= self.status < 300
+
+
+class StreamedBody:
+    """Request body made of pieces, like the serialised templates of an import, which are sent one after another
+    without joining them into one string. When compressed, the pieces are gzipped on the fly and sent with chunked
+    transfer encoding. Counts the bytes of the body before and after compression, and can be sent again."""
+
+    def __init__(self, pieces, compress=False):
+        self.pieces = pieces
+        self.compress = compress
+        self.n_bytes = 0
+        self.n_bytes_sent = 0
+
+    def get_length(self):
+        """Returns the length of the uncompressed body in bytes."""
+        return sum([len(_encode(piece)) for piece in self.pieces])
+
+    def get_text(self):
+        """Returns the uncompressed body as one string, for clients which cannot stream it."""
+        self.n_bytes = self.n_bytes_sent = self.get_length()
+        return ''.join(self.pieces)
+
+    def get_digest(self):
+        digest = hashlib.sha1()
+        for piece in self.pieces:
+            digest.update(_encode(piece))
+        return digest.hexdigest()
+
+    def get_prefix(self, length):
+        """Returns the first characters of the uncompressed body, e.g. to be logged."""
+        prefix = []
+        n_characters = 0
+        for piece in self.pieces:
+            if n_characters >= length:
+                break
+            prefix.append(piece[:length - n_characters])
+            n_characters += len(prefix[-1])
+        return ''.join(prefix)
+
+    def iter_chunks(self):
+        """Yields the non-empty chunks of bytes to send, compressed if enabled."""
+        self.n_bytes = 0
+        self.n_bytes_sent = 0
+        buffer = io.BytesIO()
+        writer = gzip.GzipFile(fileobj=buffer, mode='wb') if self.compress else buffer
+        for piece in self.pieces:
+            data = _encode(piece)
+            self.n_bytes += len(data)
+            if not self.compress and len(data) >= STREAM_CHUNK_SIZE:
+                # a large uncompressed piece is sent as it is, without copying it
+                if buffer.tell():
+                    yield self._take(buffer)
+                self.n_bytes_sent += len(data)
+                yield data
+                continue
+            writer.write(data)
+            if buffer.tell() >= STREAM_CHUNK_SIZE:
+                yield self._take(buffer)
+        if self.compress:
+            writer.close()
+        if buffer.tell():
+            yield self._take(buffer)
+
+    def _take(self, buffer):
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        self.n_bytes_sent += len(data)
+        return data
+
+
+class HttpSession:
+    """Sends requests to one HTTP server over a pool of persistent (keep-alive) connections. Credentials and proxy
+    settings are resolved once from the server dictionary, which has the same format as for xlrelease.HttpRequest.
+    Can be shared between threads. HTTPS certificates are verified by the JVM (or Python) default trust store,
+    not by the HttpClient settings applied by xlrelease.HttpRequest."""
+
+    def __init__(self, server, username=None, password=None, timeout=60, keep_alive=DEFAULT_KEEP_ALIVE):
+        url = urlparse.urlparse(server['url'])
+        self.secure = url.scheme == 'https'
+        # the header lines must not be unicode, as a compressed body is sent together with them
+        self.host = _encode(url.hostname)
+        self.port = url.port or (443 if self.secure else 80)
+        self.base_path = url.path.rstrip('/')
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.headers = {'Accept-Encoding': 'gzip'}
+        username = username or server.get('username')
+        password = password or server.get('password')
+        if username:
+            self.headers['Authorization'] = _basic_authorization(username, password)
+
+        self.proxy_host = server.get('proxyHost') and _encode(server.get('proxyHost'))
+        self.proxy_port = int(server.get('proxyPort') or 8080)
+        self.proxy_headers = {}
+        if self.proxy_host and server.get('proxyUsername'):
+            self.proxy_headers['Proxy-Authorization'] = _basic_authorization(server.get('proxyUsername'),
+                                                                             server.get('proxyPassword'))
+
+        self._idle_connections = []
+        self._lock = threading.Lock()
+        self.n_connections_opened = 0
+        self.n_requests = 0
+
+    @staticmethod
+    def supports(server):
+        """HttpSession does not implement NTLM authentication, use xlrelease.HttpRequest for such servers."""
+        return (server.get('authenticationMethod') or 'None') in ['None', 'Basic']
+
+    def get(self, context, contentType=None, timeout=None):
+        return self.request('GET', context, None, contentType, timeout)
+
+    def post(self, context, body, contentType=None, timeout=None):
+        return self.request('POST', context, body, contentType, timeout)
+
+    def put(self, context, body, contentType=None, timeout=None):
+        return self.request('PUT', context, body, contentType, timeout)
+
+    def request(self, method, context, body=None, content_type=None, timeout=None, headers=None):
+        if body is not None and not isinstance(body, (str, StreamedBody)):
+            body = body.encode('utf-8')
+        request_headers = dict(self.headers)
+        if content_type:
+            request_headers['Content-Type'] = content_type
+            request_headers['Accept'] = content_type
+        request_headers.update(headers or {})
+        with self._lock:
+            self.n_requests += 1
+
+        connection, reused = self._acquire_connection()
+        try:
+            try:
+                status, response_headers, data, will_close = self._send(connection, method, context, body,
+                                                                        request_headers, timeout)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if not reused or method not in IDEMPOTENT_METHODS:
+                    raise
+                # the server has closed the idle connection, try once again with a new one
+                connection = self._open_connection()
+                status, response_headers, data, will_close = self._send(connection, method, context, body,
+                                                                        request_headers, timeout)
+        except Exception:
+            connection.close()
+            raise
+
+        if will_close:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle_connections.append((connection, time.time()))
+        if response_headers.get('content-encoding', '').lower() == 'gzip':
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        return HttpSessionResponse(status, data)
+
+    def close(self):
+        with self._lock:
+            connections, self._idle_connections = self._idle_connections, []
+        for connection, idle_since in connections:
+            connection.close()
+
+    def get_stats(self):
+        return {
+            'n_connections_opened': self.n_connections_opened,
+            'n_requests': self.n_requests
+        }
+
+    def _send(self, connection, method, context, body, headers, timeout):
+        connection.timeout = timeout or self.timeout
+        if connection.sock:
+            connection.sock.settimeout(connection.timeout)
+        path = self.base_path + context
+        if self.proxy_host and not self.secure:
+            # plain HTTP proxies expect the absolute URL
+            path = 'http://%s:%d%s' % (self.host, self.port, path)
+            headers = dict(headers, **self.proxy_headers)
+        if isinstance(body, StreamedBody):
+            self._send_streamed(connection, method, path, body, headers)
+        else:
+            connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        # e.g. HTTP/1.0 responses or "Connection: close", httplib closes the socket itself in this case
+        will_close = response.will_close
+        return response.status, dict((k.lower(), v) for k, v in response.getheaders()), data, will_close
+
+    def _send_streamed(self, connection, method, path, body, headers):
+        connection.putrequest(method, _encode(path), skip_accept_encoding=True)
+        if body.compress:
+            # the compressed length is only known at the end
+            headers = dict(headers, **{'Content-Encoding': 'gzip', 'Transfer-Encoding': 'chunked'})
+        else:
+            headers = dict(headers, **{'Content-Length': str(body.get_length())})
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        chunks = body.iter_chunks()
+        if body.compress:
+            chunks = _frame_chunks(chunks)
+        # the headers are sent together with the first chunk, so that a small body takes one write
+        connection.endheaders(next(chunks, ''))
+        for chunk in chunks:
+            connection.send(chunk)
+
+    def _acquire_connection(self):
+        expired_connections = []
+        connection = None
+        with self._lock:
+            while self._idle_connections and not connection:
+                idle_connection, idle_since = self._idle_connections.pop()
+                # the server may have closed a connection which has been idle for too long, and requests like
+                # POST cannot be safely sent again when that is found out
+                if time.time() - idle_since < self.keep_alive:
+                    connection = idle_connection
+                else:
+                    expired_connections.append(idle_connection)
+        for expired_connection in expired_connections:
+            expired_connection.close()
+        if connection:
+            return connection, True
+        return self._open_connection(), False
+
+    def _open_connection(self):
+        connection_class = _CountedHTTPSConnection if self.secure else _CountedHTTPConnection
+        if not self.proxy_host:
+            connection = connection_class(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = connection_class(self.proxy_host, self.proxy_port, timeout=self.timeout)
+            if self.secure:
+                connection.set_tunnel(self.host, self.port, self.proxy_headers)
+        connection.session = self
+        return connection
+
+    def _count_connection(self):
+        with self._lock:
+            self.n_connections_opened += 1
+
+
+class _CountedHTTPConnection(httplib.HTTPConnection):
+    """Counts every connect, including the implicit reconnects done by httplib."""
+
+    def connect(self):
+        self.session._count_connection()
+        httplib.HTTPConnection.connect(self)
+
+
+class _CountedHTTPSConnection(httplib.HTTPSConnection):
+    def connect(self):
+        self.session._count_connection()
+        httplib.HTTPSConnection.connect(self)
+
+
+def _basic_authorization(username, password):
+    credentials = '%s:%s' % (username, password or '')
+    if not isinstance(credentials, str):
+        credentials = credentials.encode('utf-8')
+    return 'Basic %s' % base64.b64encode(credentials)
+
+
+def _frame_chunks(chunks):
+    """Frames non-empty chunks with chunked transfer encoding, the last one together with the end of the body."""
+    framed = None
+    for chunk in chunks:
+        if framed is not None:
+            yield framed
+        framed = '%x\r\n%s\r\n' % (len(chunk), chunk)
+    yield (framed or '') + '0\r\n\r\n'
+
+
+def _encode(piece):
+    return piece if isinstance(piece, str) else piece.encode('utf-8')
@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+import heapq
+import json
+import re
+import threading
+import time
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Number of the largest templates reported
+N_LARGEST_TEMPLATES = 5
+
+# IDs in request paths, replaced to group the requests by endpoint
+_ID_IN_PATH = re.compile(r'Applications[^?]*?(?=/templates$|$)')
+
+
+def create_instrumentation(push_spec):
+    return Instrumentation(push_spec.get('instrumentation', {}).get('trace', False))
+
+
+class Instrumentation:
+    """Measures the phases of a push and the calls to the local and remote instances. Can be shared between
+    threads. With tracing enabled every call is printed with its duration."""
+
+    def __init__(self, trace=False):
+        self.trace_enabled = trace
+        self._phase_seconds = {}
+        self._calls = {}  # name -> {'n_calls': ..., 'seconds': ..., 'bytes_sent': ..., 'bytes_received': ...}
+        self._histograms = {}  # name -> list of counts per latency bucket, the last one for slower calls
+        self._largest_templates = []  # heap of (size, path)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.time() - start_time)
+
+    def add_phase_time(self, name, seconds):
+        with self._lock:
+            self._phase_seconds[name] = self._phase_seconds.get(name, 0) + seconds
+
+    def add_call(self, name, seconds, bytes_sent=0, bytes_received=0):
+        with self._lock:
+            call = self._calls.setdefault(name, {'n_calls': 0, 'seconds': 0, 'bytes_sent': 0, 'bytes_received': 0})
+            call['n_calls'] += 1
+            call['seconds'] += seconds
+            call['bytes_sent'] += bytes_sent
+            call['bytes_received'] += bytes_received
+            histogram = self._histograms.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1))
+            histogram[len([bound for bound in LATENCY_BUCKETS if bound < seconds])] += 1
+        if self.trace_enabled and (bytes_sent or bytes_received):
+            print('TRACE: %s took %.3f seconds, sent %d and received %d bytes' %
+                  (name, seconds, bytes_sent, bytes_received))
+        elif self.trace_enabled:
+            print('TRACE: %s took %.3f seconds' % (name, seconds))
+
+    def add_template_size(self, path, size):
+        with self._lock:
+            if len(self._largest_templates) < N_LARGEST_TEMPLATES:
+                heapq.heappush(self._largest_templates, (size, path))
+            elif size > self._largest_templates[0][0]:
+                heapq.heapreplace(self._largest_templates, (size, path))
+
+    def instrument_api(self, api, name):
+        """Returns the API object with every method call measured as "<name>.<method>"."""
+        return _InstrumentedApi(api, name, self)
+
+    def instrument_request(self, request):
+        """Returns the HttpSession-like object with every request measured by its method and path."""
+        return _InstrumentedRequest(request, self)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'phase_seconds': dict([(name, round(seconds, 3)) for name, seconds in self._phase_seconds.items()]),
+                'calls': dict([(name, dict(call, seconds=round(call['seconds'], 3),
+                                           latency_histogram=self._get_histogram(name)))
+                               for name, call in self._calls.items()]),
+                'largest_templates': [{'path': path, 'size': size}
+                                      for size, path in sorted(self._largest_templates, reverse=True)]
+            }
+
+    def _get_histogram(self, name):
+        labels = ['<=%ss' % bound for bound in LATENCY_BUCKETS] + ['>%ss' % LATENCY_BUCKETS[-1]]
+        return dict([(label, count) for label, count in zip(labels, self._histograms[name]) if count])
+
+
+def merge_stats(stats_list):
+    """Merges the statistics of several Instrumentation objects, e.g. of the local and the remote instance."""
+    merged = {'phase_seconds': {}, 'calls': {}, 'largest_templates': []}
+    for stats in stats_list:
+        merged['phase_seconds'].update(stats['phase_seconds'])
+        merged['calls'].update(stats['calls'])
+        merged['largest_templates'].extend(stats['largest_templates'])
+    merged['largest_templates'].sort(key=lambda template: template['size'], reverse=True)
+    del merged['largest_templates'][N_LARGEST_TEMPLATES:]
+    return merged
+
+
+def log_stats(stats):
+    """Writes the statistics to the server log as one line of JSON, so that it can be parsed by log tools."""
+    line = 'xlrconfig push stats: %s' % json.dumps(stats, sort_keys=True)
+    try:
+        from org.slf4j import LoggerFactory
+        LoggerFactory.getLogger('xlrconfig').info(line)
+    except ImportError:
+        print(line)
+
+
+class _InstrumentedApi:
+    def __init__(self, api, name, instrumentation):
+        self._api = api
+        self._name = name
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, method_name):
+        method = getattr(self._api, method_name)
+
+        def measured_method(*args):
+            start_time = time.time()
+            try:
+                return method(*args)
+            finally:
+                self._instrumentation.add_call('%s.%s' % (self._name, method_name), time.time() - start_time)
+        return measured_method
+
+
+class _InstrumentedRequest:
+    def __init__(self, request, instrumentation):
+        self._request = request
+        self._instrumentation = instrumentation
+
+    def get(self, context, **kwargs):
+        return self._measure('GET', context, None, lambda: self._request.get(context, **kwargs))
+
+    def post(self, context, body, **kwargs):
+        return self._measure('POST', context, body, lambda: self._request.post(context, body, **kwargs))
+
+    def put(self, context, body, **kwargs):
+        return self._measure('PUT', context, body, lambda: self._request.put(context, body, **kwargs))
+
+    def _measure(self, method, context, body, send):
+        start_time = time.time()
+        response = None
+        try:
+            response = send()
+            return response
+        finally:
+            endpoint = '%s %s' % (method, _ID_IN_PATH.sub('{id}', context.split('?', 1)[0]))
+            self._instrumentation.add_call(endpoint, time.time() - start_time, _get_body_length(body),
+                                           len(response.response or '') if response is not None else 0)
+
+
+def _get_body_length(body):
+    # a streamed body knows how many bytes it has sent, possibly compressed
+    n_bytes_sent = getattr(body, 'n_bytes_sent', None)
+    return n_bytes_sent if n_bytes_sent is not None else len(body or '')
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import threading
+import traceback
+import uuid
+
+
+# Number of finished jobs whose events can still be read
+MAX_FINISHED_JOBS = 20
+
+# Approximate amount of events returned by one status request
+MAX_READ_BYTES = 1024 * 1024
+
+_jobs = []
+_jobs_lock = threading.Lock()
+
+
+def start_job(run):
+    """Runs run(job) in a background thread and returns the job. The function reports events with
+    job.report(), and returns the statistics which are reported as the last event."""
+    job = PushJob()
+    with _jobs_lock:
+        finished_jobs = [other for other in _jobs if other.status != 'running']
+        for old_job in finished_jobs[:max(0, len(finished_jobs) - MAX_FINISHED_JOBS + 1)]:
+            _jobs.remove(old_job)
+            old_job.delete()
+        _jobs.append(job)
+    thread = threading.Thread(target=job.run, args=(run,), name='xlrconfig-job-%s' % job.id)
+    thread.daemon = True
+    thread.start()
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return next(iter([job for job in _jobs if job.id == job_id]), None)
+
+
+class PushJob:
+    """A push running in the background. Its actions, warnings and errors are written as soon as they are added,
+    one JSON object per line, to a temporary file, so that they can be read while the job is running."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        handle, self.file_name = tempfile.mkstemp(prefix='xlrconfig-job-', suffix='.ndjson')
+        os.close(handle)
+        self.status = 'running'
+        self._file = open(self.file_name, 'a')
+        self._lock = threading.Lock()
+
+    def run(self, run):
+        try:
+            self.report('stats', run(self))
+            self._finish('finished')
+        except Exception as e:
+            traceback.print_exc()
+            self._finish('failed', str(e))
+
+    def report(self, event_type, value):
+        line = json.dumps({'type': event_type, 'value': value})
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def _finish(self, status, error=None):
+        self.report('end', {'status': status, 'error': error})
+        with self._lock:
+            self._file.close()
+            self.status = status
+
+    def read_events(self, cursor, compact):
+        """Returns the events written after the given cursor, and the cursor to read the next events from.
+        In compact mode the entities of the actions are left out."""
+        events = []
+        with open(self.file_name, 'r') as f:
+            f.seek(cursor)
+            n_read_bytes = 0
+            while n_read_bytes < MAX_READ_BYTES:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break  # nothing more, or the line is being written
+                n_read_bytes += len(line)
+                event = json.loads(line)
+                if compact and event['type'] == 'action':
+                    event['value'] = dict([(key, value) for key, value in event['value'].items() if key != 'entity'])
+                events.append(event)
+        return events, cursor + n_read_bytes
+
+    def delete(self):
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
@@ -0,0 +1,80 @@
+from xlrconfig import get_storage_file
+from xlrconfig.manifest import get_spec_fingerprint
+import json
+import os
+import threading
+
+
+# Version of the journal file format, journals of other versions are not resumed
+JOURNAL_VERSION = 1
+
+
+class ImportJournal:
+    """Templates imported to one remote instance by the current push, appended and synced to disk as soon as their
+    batch has been imported, so that an interrupted push can be resumed without importing them again."""
+
+    def __init__(self, file_name, spec_fingerprint, resume):
+        self.file_name = file_name
+        self.spec_fingerprint = spec_fingerprint
+        self.resume = resume
+        self._entries = {}  # local template ID -> {'remote_id': ..., 'hash': ...}
+        self._file = None
+        self._lock = threading.Lock()
+        if resume and os.path.exists(file_name):
+            self._load()
+
+    def _load(self):
+        with open(self.file_name) as f:
+            lines = f.readlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        # templates are imported again if they would be renamed differently
+        if header.get('version') != JOURNAL_VERSION or header.get('spec') != self.spec_fingerprint:
+            print('WARN: not resuming from the journal [%s] of another version or specification' % self.file_name)
+            self.resume = False
+            return
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # the last line may be incomplete when the previous push was interrupted
+            self._entries[entry['id']] = {'remote_id': entry['remote_id'], 'hash': entry['hash']}
+
+    def get_remote_id(self, template_id, fingerprint):
+        """Returns the remote ID of the template if it has been imported with the same content before."""
+        entry = self._entries.get(template_id)
+        if entry and entry['hash'] == fingerprint:
+            return entry['remote_id']
+        return None
+
+    def open(self):
+        """Starts writing the journal, after the previous entries when resuming, or in place of them otherwise."""
+        if self.resume and self._entries:
+            self._file = open(self.file_name, 'a')
+        else:
+            self._file = open(self.file_name, 'w')
+            self._write([{'version': JOURNAL_VERSION, 'spec': self.spec_fingerprint}])
+
+    def record(self, imported):
+        """Appends the list of (template details, remote ID) of an imported batch."""
+        with self._lock:
+            self._write([{'id': template['id'], 'remote_id': remote_id, 'hash': template['hash']}
+                         for template, remote_id in imported])
+
+    def _write(self, entries):
+        self._file.write(''.join([json.dumps(entry) + '\n' for entry in entries]))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+
+
+def create_journal(push_spec, server_url):
+    return ImportJournal(get_storage_file(push_spec, 'journal', server_url), get_spec_fingerprint(push_spec),
+                         push_spec.get('import', {}).get('resume', False))
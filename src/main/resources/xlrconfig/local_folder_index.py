@@ -0,0 +1,89 @@
+from xlrconfig import get_parent
+
+
+# Depth of the folder tree loaded with a folder, deeper than any real hierarchy
+FOLDER_TREE_DEPTH = 1000
+
+
+class LocalFolderIndex:
+    """Titles and parents of the local folders, loaded with one listing of the whole folder tree when a folder
+    is not known yet, with their full paths memoised. Folders created after the listing are fetched one by one."""
+
+    def __init__(self, folder_api, page_size):
+        self.folder_api = folder_api
+        self.page_size = page_size
+        self._folders = {}  # folder ID -> (title, parent folder ID)
+        self._paths = {}  # folder ID -> path
+        self._ids_by_path = None
+        self._loaded = False
+
+    def add_tree(self, folder, path=None):
+        """Adds a folder loaded with its children, e.g. found by its path, so that its subtree needs no listing."""
+        if path:
+            self._paths[_normalize(folder.getId())] = path
+        folders = [folder]
+        while folders:
+            folder = folders.pop()
+            folder_id = _normalize(folder.getId())
+            self._folders[folder_id] = (folder.getTitle(), get_parent(folder_id))
+            folders.extend(folder.getChildren() or [])
+        self._ids_by_path = None
+
+    def load(self):
+        if self._loaded:
+            return
+        page = 0
+        while True:
+            # page, resultsPerPage, depth, decorateWithPermissions
+            roots = self.folder_api.listRoot(page, self.page_size, FOLDER_TREE_DEPTH, False)
+            if len(roots) == 0:
+                break
+            for root in roots:
+                self.add_tree(root)
+            page += 1
+        self._loaded = True
+
+    def get_path(self, folder_id):
+        """Returns the path of titles of the folder, or None for the root 'Applications'."""
+        folder_id = _normalize(folder_id)
+        if folder_id in self._paths:
+            return self._paths[folder_id]
+        # walk up to the first folder with a known path, then down again
+        unresolved = []
+        path = None
+        while folder_id and '/' in folder_id:
+            if folder_id in self._paths:
+                path = self._paths[folder_id]
+                break
+            unresolved.append(folder_id)
+            folder_id = self._get_folder(folder_id)[1]
+        for folder_id in reversed(unresolved):
+            title = self._folders[folder_id][0]
+            path = '%s/%s' % (path, title) if path else title
+            self._paths[folder_id] = path
+        return path
+
+    def get_item_path(self, ci_id, title):
+        """Returns the path of a template or another item stored in a folder."""
+        folder_path = self.get_path(get_parent(_normalize(ci_id)))
+        return '%s/%s' % (folder_path, title) if folder_path else title
+
+    def get_folder_id(self, path):
+        """Returns the ID of the local folder with the given path, or None if there's no such folder."""
+        self.load()
+        if self._ids_by_path is None:
+            self._ids_by_path = dict([(self.get_path(folder_id), folder_id) for folder_id in self._folders])
+        return self._ids_by_path.get(path)
+
+    def _get_folder(self, folder_id):
+        if folder_id not in self._folders:
+            self.load()
+        if folder_id not in self._folders:
+            folder = self.folder_api.getFolder(folder_id)
+            self._folders[folder_id] = (folder.getTitle(), get_parent(folder_id))
+            self._ids_by_path = None
+        return self._folders[folder_id]
+
+
+def _normalize(ci_id):
+    return ci_id[1:] if ci_id.startswith('/') else ci_id
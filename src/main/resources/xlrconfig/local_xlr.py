@@ -1,19 +1,41 @@
 from com.xebialabs.deployit.plumbing import CurrentVersion
 from com.xebialabs.deployit import ServerConfiguration
 from com.xebialabs.deployit.exception import NotFoundException
-from xlrconfig import get_parent
-import re
+from xlrconfig.instrumentation import Instrumentation
+from xlrconfig.local_folder_index import LocalFolderIndex, FOLDER_TREE_DEPTH
+from xlrconfig.lookup_cache import CacheStore
+from xlrconfig.manifest import get_fingerprint
+from xlrconfig.payload_store import PayloadStore
+from xlrconfig.spec import compile_spec, plan_template_discovery
 
 
+# Number of templates and folders fetched per request when listing them
+DEFAULT_PAGE_SIZE = 100
+
+# Depth of CIs loaded when listing templates: enough for the ID and title, without phases and tasks
+LISTING_DEPTH = 1
+
+# Kinds of properties which refer to other CIs, e.g. to shared configurations
+_CI_PROPERTY_KINDS = ['CI', 'SET_OF_CI', 'LIST_OF_CI']
+
 # noinspection PyMethodMayBeStatic
 class LocalXlr:
-    def __init__(self, push_spec, xlr_services):
+    def __init__(self, push_spec, xlr_services, cache_store=None, instrumentation=None):
         self.push_spec = push_spec
-        self.template_api = xlr_services['templateApi']
-        self.folder_api = xlr_services['folderApi']
-        self.configuration_api = xlr_services['configurationApi']
-        self._folder_names_cache = {}
+        self.spec = compile_spec(push_spec)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.template_api = self.instrumentation.instrument_api(xlr_services['templateApi'], 'templateApi')
+        self.folder_api = self.instrumentation.instrument_api(xlr_services['folderApi'], 'folderApi')
+        self.configuration_api = self.instrumentation.instrument_api(xlr_services['configurationApi'],
+                                                                     'configurationApi')
+        self.cache_store = cache_store or CacheStore()
         self._configurations_details_cache = {}
+        # titles of the listed templates, so that referenced templates don't have to be loaded
+        self._template_titles_cache = {}
+        self.page_size = push_spec['templates'].get('pageSize', DEFAULT_PAGE_SIZE)
+        self.folders = LocalFolderIndex(self.folder_api, self.page_size)
+        self.payloads = PayloadStore()
+        self.stats = {}
 
     def get_local_xlr_details(self):
         return {
@@ -21,102 +43,203 @@ class LocalXlr:
             'version': CurrentVersion.get()
         }
 
-    def get_templates_to_push(self):
+    def get_templates_to_push(self, is_unchanged=None):
+        """Returns the details of the templates matching the specification, except the ones for which
+        the optional `is_unchanged` function returns True. The function gets the details with the content hash."""
         templates_spec = self.push_spec['templates']
-        matching_templates_details = []
-        page_size = 20
-        page = 0
-        while True:
-            # title, tags, page, resultsPerPage, depth
-            templates_page = self.template_api.getTemplates(None, None, page, page_size, 1000)
+        folder_paths = plan_template_discovery(templates_spec['include'])
+        if folder_paths is None:
+            templates = self._get_all_templates()
+        else:
+            templates = self._get_templates_in_folders(folder_paths)
 
-            templates_with_details = map(lambda t: (t, self._get_template_id_and_path(t)), templates_page)
-            for (template, details) in templates_with_details:
-                if self._matches_spec(details['path'], templates_spec):
-                    details.update(self._get_template_references(template))
+        matching_templates_details = []
+        n_scanned_templates = 0
+        with self.instrumentation.phase('local_listing'):
+            for template in templates:
+                n_scanned_templates += 1
+                details = self._get_template_id_and_path(template)
+                if self.spec.matches(details['path']):
                     matching_templates_details.append(details)
 
-            if len(templates_page) == 0:
-                # no more templates
+        # only the matching templates are loaded completely, one at a time, and serialised once for the import
+        templates_to_push = []
+        for details in matching_templates_details:
+            template, template_json, template_warnings = self._load_template(details)
+            details['hash'] = get_fingerprint(template_json)
+            if is_unchanged and is_unchanged(details):
+                continue
+            with self.instrumentation.phase('reference_extraction'):
+                details.update(self._get_template_references(template))
+            with self.instrumentation.phase('payload_storage'):
+                self.payloads.put(details['id'], template_json, template_warnings)
+            templates_to_push.append(details)
+
+        print('Scanned %d local templates in %s, %d of them match the specification' % (
+            n_scanned_templates, folder_paths if folder_paths is not None else 'all folders',
+            len(matching_templates_details)))
+        self.stats['n_scanned_templates'] = n_scanned_templates
+        self.stats['n_matched_templates'] = len(matching_templates_details)
+        return templates_to_push
+
+    def reload_templates(self, templates_details):
+        """Serialises the templates of a saved plan again for the import. Returns the paths of the templates
+        which have been changed or deleted since the plan was made, these are not stored."""
+        changed_paths = []
+        for details in templates_details:
+            try:
+                template, template_json, template_warnings = self._load_template(details)
+            except NotFoundException:
+                changed_paths.append(details['path'])
+                continue
+            if get_fingerprint(template_json) != details['hash']:
+                changed_paths.append(details['path'])
+                continue
+            with self.instrumentation.phase('payload_storage'):
+                self.payloads.put(details['id'], template_json, template_warnings)
+        return changed_paths
+
+    def _load_template(self, details):
+        """Returns the template with its JSON for the import and the warnings about the parts not pushed."""
+        with self.instrumentation.phase('local_loading'):
+            template = self.get_template(details['id'])
+            template_warnings = []
+            self.strip_attachments_and_warn(template, template_warnings)
+            self.check_triggers_and_warn(template, template_warnings)
+        with self.instrumentation.phase('serialisation'):
+            template_json = self.to_json(template)
+        self.instrumentation.add_template_size(details['path'], len(template_json))
+        return template, template_json, template_warnings
+
+    def _get_all_templates(self):
+        # title, tags, page, resultsPerPage, depth
+        return self._get_pages(lambda page, page_size: self.template_api.getTemplates(None, None, page, page_size,
+                                                                                      LISTING_DEPTH))
+
+    def _get_templates_in_folders(self, folder_paths):
+        for folder_path in folder_paths:
+            try:
+                folder = self.folder_api.find(folder_path, FOLDER_TREE_DEPTH)
+            except NotFoundException:
+                print('WARN: could not find local folder [%s], no templates are taken from it' % folder_path)
+                continue
+            # the folders of the subtree are known now, so building template paths needs no folder listing
+            self.folders.add_tree(folder, folder_path)
+            for folder_id in self._get_subtree_folder_ids(folder):
+                # folderId, page, resultsPerPage, depth
+                for template in self._get_pages(lambda page, page_size: self.folder_api.getTemplates(
+                        folder_id, page, page_size, LISTING_DEPTH)):
+                    yield template
+
+    def _get_subtree_folder_ids(self, folder):
+        folder_ids = []
+        folders = [folder]
+        while folders:
+            folder = folders.pop()
+            folder_ids.append(self._normalize(folder.getId()))
+            folders.extend(folder.getChildren() or [])
+        return folder_ids
+
+    def _get_pages(self, get_page):
+        page = 0
+        while True:
+            items_page = get_page(page, self.page_size)
+            if len(items_page) == 0:
+                # no more items
                 break
+            for item in items_page:
+                yield item
             page += 1
 
-        return matching_templates_details
-
     def _get_template_id_and_path(self, template):
         ci_id = self._normalize(template.getId())
-        path = self.get_name_path(ci_id, template.getTitle())
+        self._template_titles_cache[ci_id] = template.getTitle()
+        path = self.folders.get_item_path(ci_id, template.getTitle())
         return {
             'id': ci_id,
             'path': path
         }
 
     def _get_template_references(self, template):
-        referenced_configurations = self._get_referenced_configurations(template)
-        referenced_templates = self._get_referenced_templates(template)
+        """Collects the shared configurations and the CreateReleaseTask templates referenced by the template,
+        going through its CIs once."""
+        referenced_configurations = []
+        referenced_templates = []
+        configuration_ids = set()
+        for ci in self._get_template_cis(template):
+            if ci.getType().toString() == 'xlrelease.CreateReleaseTask' and ci.getProperty('templateId'):
+                referenced_template = self._get_referenced_template(template, ci)
+                if referenced_template:
+                    referenced_templates.append(referenced_template)
+            for referenced_ci in self._get_referenced_cis(ci):
+                if referenced_ci.getId().startswith('Configuration/Custom/') and \
+                        referenced_ci.getId() not in configuration_ids:
+                    configuration_ids.add(referenced_ci.getId())
+                    referenced_configurations.append(self._get_configuration_details(referenced_ci))
         return {
             'referenced_configurations': referenced_configurations,
             'referenced_templates': referenced_templates
         }
 
-    def get_name_path(self, ci_id, ci_path):
-        parent_id = get_parent(ci_id)
-        if not parent_id or '/' not in parent_id:
-            return ci_path  # stop on 'Applications'
-        if parent_id in self._folder_names_cache:
-            parent_name = self._folder_names_cache[parent_id]
-        else:
-            parent_name = self.folder_api.getFolder(parent_id).getTitle()
-            self._folder_names_cache[parent_id] = parent_name
-        return self.get_name_path(parent_id, parent_name + '/' + ci_path)
+    def _get_template_cis(self, template):
+        cis = [template]
+        cis.extend(template.getVariables() or [])
+        for task in template.getAllTasks():
+            cis.append(task)
+            cis.extend(task.getFacets() or [])
+        cis.extend(template.getReleaseTriggers() or [])
+        return cis
 
-    def _matches_spec(self, path, spec):
-        return any(map(
-            # check for full match, so all characters should be part of the pattern
-            lambda pattern: re.match(pattern, path) and len(re.match(pattern, path).group(0)) == len(path),
-            spec['include']
-        ))
+    def _get_referenced_cis(self, ci):
+        for property_descriptor in ci.getType().getDescriptor().getPropertyDescriptors():
+            kind = property_descriptor.getKind().toString()
+            if kind in _CI_PROPERTY_KINDS:
+                value = property_descriptor.get(ci)
+                if value is not None:
+                    for referenced_ci in ([value] if kind == 'CI' else value):
+                        if referenced_ci is not None and referenced_ci.getId():
+                            yield referenced_ci
 
     def _normalize(self, ci_id):
         return ci_id[1:] if ci_id.startswith('/') else ci_id
 
-    def _get_referenced_configurations(self, template):
-        referenced_configurations = []
-        template_json = self.to_json(template)
-        for config_id in set(re.findall('"Configuration/Custom/[\w /]+"', template_json)):
-            config_id = config_id.replace('"', '')
-            if config_id in self._configurations_details_cache:
-                config_details = self._configurations_details_cache[config_id]
-            else:
+    def _get_configuration_details(self, config):
+        config_id = config.getId()
+        if config_id not in self._configurations_details_cache:
+            if config.getTitle() is None:
+                # not loaded with the template
                 config = self.configuration_api.getConfiguration(config_id)
-                config_details = {
-                    'id': config.getId(),
-                    'type': config.getType().toString(),
-                    'title': config.getTitle()
-                }
-                self._configurations_details_cache[config_id] = config_details
-            referenced_configurations.append(config_details)
-        return referenced_configurations
-
-    def _get_referenced_templates(self, template):
-        referenced_templates = []
-        for task in template.getAllTasks():
-            if task.getType().toString() == 'xlrelease.CreateReleaseTask' and task.getProperty('templateId'):
-                referenced_template_id = task.getProperty('templateId')
-                try:
-                    referenced_template = self.template_api.getTemplate(referenced_template_id)
-                    referenced_template_path = self.get_name_path(referenced_template_id,
-                                                                  referenced_template.getTitle())
-                    referenced_templates.append({
-                        'id': referenced_template_id,
-                        'path': referenced_template_path,
-                        'from_task_id': task.getId()
-                    })
-                except NotFoundException as e:
-                    print('WARN: could not find template by ID [%s] referenced by task [%s](%s) '
-                          'of template [%s](%s): %s' % (referenced_template_id, task.getTitle(), task.getId(),
-                                                        template.getTitle(), template.getId(), e))
-        return referenced_templates
+            self._configurations_details_cache[config_id] = {
+                'id': config_id,
+                'type': config.getType().toString(),
+                'title': config.getTitle()
+            }
+        return self._configurations_details_cache[config_id]
+
+    def _get_referenced_template(self, template, task):
+        referenced_template_id = task.getProperty('templateId')
+        normalized_id = self._normalize(referenced_template_id)
+        if normalized_id not in self._template_titles_cache:
+            # the template has not been listed, as it is in a folder which is not scanned
+            try:
+                self._template_titles_cache[normalized_id] = self.template_api.getTemplate(
+                    referenced_template_id).getTitle()
+            except NotFoundException:
+                self._template_titles_cache[normalized_id] = None
+        title = self._template_titles_cache[normalized_id]
+        if title is None:
+            print('WARN: could not find template by ID [%s] referenced by task [%s](%s) of template [%s](%s)' %
+                  (referenced_template_id, task.getTitle(), task.getId(), template.getTitle(), template.getId()))
+            return None
+        return {
+            'id': referenced_template_id,
+            'path': self.folders.get_item_path(normalized_id, title),
+            'from_task_id': task.getId()
+        }
+
+    def close(self):
+        self.payloads.close()
+        self.cache_store.save()
 
     def get_template(self, template_id):
         return self.template_api.getTemplate(template_id)
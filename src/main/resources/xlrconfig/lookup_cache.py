@@ -0,0 +1,131 @@
+from xlrconfig import get_storage_file
+import json
+import os
+import threading
+import time
+
+
+# Returned by LookupCache.get() when there is no value for a key, as None is a valid looked up value
+MISSING = object()
+
+# Defaults of the persistent cache: entries expire after an hour
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class LookupCache:
+    """Values looked up by a key, e.g. remote folder IDs by their paths. Can be shared between threads.
+    Values expire after `ttl` seconds, and the oldest ones are evicted when there are more than `max_entries`.
+    Only found values are saved for the next runs, as a missing entity may be created in the meantime."""
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._values = {}  # key -> (value, time when it was put)
+        self._loaded_keys = set()  # keys of the values looked up by a previous run
+        self._lock = threading.Lock()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key, None)
+            if entry is not None and self._is_expired(entry):
+                del self._values[key]
+                entry = None
+            if entry is None:
+                self.n_misses += 1
+                return MISSING
+            self.n_hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        self._put(key, value, time.time())
+        self._loaded_keys.discard(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+            self._loaded_keys.discard(key)
+
+    def is_loaded(self, key):
+        """Tells if the value of the key has been looked up by a previous run."""
+        return key in self._loaded_keys
+
+    def to_json(self):
+        with self._lock:
+            return [[key, value, put_time] for key, (value, put_time) in self._values.items()
+                    if value is not None and not self._is_expired((value, put_time))]
+
+    def load_json(self, entries):
+        for key, value, put_time in entries:
+            if not self._is_expired((value, put_time)):
+                self._put(key, value, put_time)
+                self._loaded_keys.add(key)
+
+    def _put(self, key, value, put_time):
+        with self._lock:
+            self._values[key] = (value, put_time)
+            if self.max_entries and len(self._values) > self.max_entries:
+                # evict the oldest tenth at once, so that eviction does not happen on every put
+                n_evicted = len(self._values) - self.max_entries + self.max_entries // 10
+                oldest = sorted(self._values.items(), key=lambda item: item[1][1])[:n_evicted]
+                for evicted_key, entry in oldest:
+                    del self._values[evicted_key]
+                    self._loaded_keys.discard(evicted_key)
+
+    def _is_expired(self, entry):
+        return self.ttl is not None and time.time() - entry[1] > self.ttl
+
+
+class CacheStore:
+    """Named lookup caches of one XL Release instance. When a file is given, the caches are loaded from it
+    and saved back to it, so that lookups are reused between runs."""
+
+    def __init__(self, file_name=None, ttl=None, max_entries=None):
+        self.file_name = file_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._caches = {}
+        self._saved_entries = {}
+        if file_name and os.path.exists(file_name):
+            try:
+                with open(file_name) as f:
+                    self._saved_entries = json.load(f)
+            except ValueError:
+                print('WARN: ignoring the corrupted cache file [%s]' % file_name)
+
+    def get_cache(self, name):
+        if name not in self._caches:
+            cache = LookupCache(self.ttl, self.max_entries)
+            cache.load_json(self._saved_entries.pop(name, []))
+            self._caches[name] = cache
+        return self._caches[name]
+
+    def save(self):
+        if not self.file_name:
+            return
+        entries = dict(self._saved_entries)
+        entries.update([(name, cache.to_json()) for name, cache in self._caches.items()])
+        # write to a temporary file first, so that a concurrent run never reads a half-written cache
+        temporary_file_name = '%s.%d.tmp' % (self.file_name, os.getpid())
+        with open(temporary_file_name, 'w') as f:
+            json.dump(entries, f)
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)  # rename does not overwrite on Windows
+        os.rename(temporary_file_name, self.file_name)
+
+    def get_stats(self):
+        return {
+            'n_cache_hits': sum([cache.n_hits for cache in self._caches.values()]),
+            'n_cache_misses': sum([cache.n_misses for cache in self._caches.values()])
+        }
+
+
+def create_cache_store(push_spec, kind, server_url):
+    """Creates the cache store configured by the "cache" section of the push specification."""
+    cache_spec = push_spec.get('cache', {})
+    if not cache_spec.get('enabled', False):
+        return CacheStore()
+    return CacheStore(get_storage_file(push_spec, kind, server_url),
+                      cache_spec.get('ttlSeconds', DEFAULT_TTL), cache_spec.get('maxEntries', DEFAULT_MAX_ENTRIES))
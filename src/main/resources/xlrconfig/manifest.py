@@ -0,0 +1,72 @@
+from xlrconfig import get_storage_file
+import hashlib
+import json
+import os
+
+
+# Version of the manifest file format, manifests of other versions are ignored
+MANIFEST_VERSION = 1
+
+
+def get_fingerprint(template_json):
+    """Returns the content hash of a serialised template. The serialiser writes the properties of a template
+    in the same order every time, so equal templates have equal hashes."""
+    if not isinstance(template_json, str):
+        template_json = template_json.encode('utf-8')
+    return hashlib.sha1(template_json).hexdigest()
+
+
+def get_spec_fingerprint(push_spec):
+    """Returns the hash of the parts of the push specification which change the pushed content."""
+    renamings = [push_spec.get('folders', {}).get('rename', {}),
+                 push_spec.get('configurations', {}).get('rename', {})]
+    return hashlib.sha1(json.dumps(renamings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """Content hashes and remote IDs of the templates pushed to one remote instance by the previous runs,
+    so that the next runs push only the new and changed templates."""
+
+    def __init__(self, file_name, spec_fingerprint):
+        self.file_name = file_name
+        self.spec_fingerprint = spec_fingerprint
+        self._entries = {}  # local template ID -> {'hash': ..., 'remote_id': ...}
+        if os.path.exists(file_name):
+            try:
+                with open(file_name) as f:
+                    saved = json.load(f)
+            except ValueError:
+                print('WARN: ignoring the corrupted manifest file [%s]' % file_name)
+                return
+            # templates are pushed again if they would be renamed differently
+            if saved.get('version') == MANIFEST_VERSION and saved.get('spec') == spec_fingerprint:
+                self._entries = saved['templates']
+
+    def get_state(self, template_id, fingerprint):
+        """Tells if the template is 'new', 'changed' or 'unchanged' since it has been pushed last time."""
+        entry = self._entries.get(template_id)
+        if entry is None:
+            return 'new'
+        return 'unchanged' if entry['hash'] == fingerprint else 'changed'
+
+    def put(self, template_id, fingerprint, remote_id):
+        self._entries[template_id] = {'hash': fingerprint, 'remote_id': remote_id}
+
+    def get_remote_id(self, template_id):
+        entry = self._entries.get(template_id)
+        return entry['remote_id'] if entry else None
+
+    def save(self):
+        temporary_file_name = '%s.%d.tmp' % (self.file_name, os.getpid())
+        with open(temporary_file_name, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'spec': self.spec_fingerprint, 'templates': self._entries}, f)
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)  # rename does not overwrite on Windows
+        os.rename(temporary_file_name, self.file_name)
+
+
+def create_manifest(push_spec, server_url):
+    """Creates the manifest of the given remote instance if the incremental push is enabled, or returns None."""
+    if not push_spec['templates'].get('incremental', False):
+        return None
+    return Manifest(get_storage_file(push_spec, 'manifest', server_url), get_spec_fingerprint(push_spec))
@@ -0,0 +1,47 @@
+import os
+import struct
+import tempfile
+import threading
+
+
+class PayloadStore:
+    """Keeps the serialised JSON of each pushed template between the discovery and the import phases.
+    Payloads are appended to one temporary spool file as length-prefixed UTF-8 records and read back one at a time,
+    so that only their offsets and warnings stay in memory. Can be read by several threads."""
+
+    def __init__(self):
+        self.file_name = None
+        self._file = None
+        self._entries = {}  # template ID -> (offset, length, warnings)
+        self._lock = threading.Lock()
+
+    def put(self, template_id, payload, warnings):
+        data = payload.encode('utf-8')
+        with self._lock:
+            if self._file is None:
+                handle, self.file_name = tempfile.mkstemp(prefix='xlrconfig-payloads-', suffix='.spool')
+                self._file = os.fdopen(handle, 'w+b')
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(struct.pack('>I', len(data)))
+            offset = self._file.tell()
+            self._file.write(data)
+        self._entries[template_id] = (offset, len(data), list(warnings))
+
+    def get(self, template_id):
+        offset, length, warnings = self._entries[template_id]
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        return data.decode('utf-8')
+
+    def get_warnings(self, template_id):
+        return self._entries[template_id][2]
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                os.remove(self.file_name)
+            self._file = None
+            self.file_name = None
+            self._entries = {}
@@ -0,0 +1,54 @@
+from xlrconfig import get_storage_file
+from xlrconfig.manifest import get_spec_fingerprint
+import hashlib
+import json
+import os
+import time
+
+
+# Version of the plan file format, plans of other versions cannot be applied
+PLAN_VERSION = 1
+
+
+def get_plan_fingerprint(push_spec):
+    """Returns the hash of the parts of the push specification which change the plan."""
+    parts = [push_spec['templates']['include'], get_spec_fingerprint(push_spec)]
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def get_plan_file(push_spec, plan_name, server_url):
+    return get_storage_file(push_spec, 'plan-%s' % plan_name, server_url)
+
+
+def save_plan(file_name, push_spec, server_url, import_levels):
+    """Writes the templates to import, by level, with their remote folder, configuration and template IDs and
+    their content hashes, so that the push can be executed later without scanning and looking them up again."""
+    plan = {
+        'version': PLAN_VERSION,
+        'target': server_url,
+        'spec': get_plan_fingerprint(push_spec),
+        'created': int(time.time()),
+        'levels': import_levels
+    }
+    temporary_file_name = '%s.%d.tmp' % (file_name, os.getpid())
+    with open(temporary_file_name, 'w') as f:
+        json.dump(plan, f, separators=(',', ':'))
+    if os.path.exists(file_name):
+        os.remove(file_name)  # rename does not overwrite on Windows
+    os.rename(temporary_file_name, file_name)
+
+
+def load_plan(file_name, push_spec, server_url):
+    """Returns the import levels of a saved plan, failing if it has been made for another target or specification."""
+    if not os.path.exists(file_name):
+        raise Exception('Cannot apply the plan [%s] to [%s] as it does not exist, save it with a dry run first' %
+                        (file_name, server_url))
+    with open(file_name) as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise Exception('Cannot apply the plan [%s] of version %s, make it again with a dry run' %
+                        (file_name, plan.get('version')))
+    if plan['target'] != server_url or plan['spec'] != get_plan_fingerprint(push_spec):
+        raise Exception('Cannot apply the plan [%s] as it has been made for another target or specification, '
+                        'make it again with a dry run' % file_name)
+    return plan['levels']
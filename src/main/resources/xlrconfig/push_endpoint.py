@@ -1,5 +1,7 @@
 from com.xebialabs.deployit.security import Permissions
-from xlrconfig.configuration_pusher import push_configuration
+from org.springframework.security.core.context import SecurityContextHolder
+from xlrconfig.configuration_pusher import push_configuration, push_configuration_to_targets
+from xlrconfig.jobs import start_job
 # reload(xlrconfig) uncomment this for faster development cycle
 
 if Permissions.getAuthenticatedUserName() != 'admin':
@@ -21,39 +23,68 @@ def to_dict(http_configuration):
     }
 
 
-xlr_server_name = request.query.get('targetXlrName')
+# several servers can be given separated by commas, the configuration is pushed to all of them at the same time
+xlr_server_names = [name.strip() for name in (request.query.get('targetXlrName') or '').split(',') if name.strip()]
 dry_run = request.query.get('dryRun', '').lower() == 'true'
+async_run = request.query.get('async', '').lower() == 'true'
 push_config = request.entity
 
-xlr_server = next(iter(configurationApi.searchByTypeAndTitle('xlrconfig.XLReleaseServer', xlr_server_name)), None) \
-    if xlr_server_name else None
+xlr_servers = [next(iter(configurationApi.searchByTypeAndTitle('xlrconfig.XLReleaseServer', name)), None)
+               for name in xlr_server_names]
+missing_xlr_server_names = [name for name, xlr_server in zip(xlr_server_names, xlr_servers) if not xlr_server]
 
 
-if xlr_server and push_config:
+if xlr_servers and not missing_xlr_server_names and push_config:
 
-    logger.info('Processing the following spec to target XL Release [%s], dry run = %s: %s' %
-                (xlr_server_name, dry_run, push_config))
+    logger.info('Processing the following spec to target XL Release %s, dry run = %s: %s' %
+                (xlr_server_names, dry_run, push_config))
 
     # Get the passwords and convert to a dict, as that's expected by the underlying HttpRequest
-    xlr_server = securityApi.decrypt(configurationApi.getConfiguration(xlr_server.getId()))
-    xlr_server = to_dict(xlr_server)
+    targets = [(to_dict(securityApi.decrypt(configurationApi.getConfiguration(xlr_server.getId()))), None, None)
+               for xlr_server in xlr_servers]
 
-    executed_actions = push_configuration((xlr_server, None, None), push_config, dry_run, {
+    xlr_services = {
         'folderApi': folderApi,
         'templateApi': templateApi,
         'configurationApi': configurationApi
-    })
+    }
+
+    def run_push(listener):
+        if len(targets) == 1:
+            return push_configuration(targets[0], push_config, dry_run, xlr_services, listener)
+        return push_configuration_to_targets(targets, push_config, dry_run, xlr_services, listener)
+
+    if async_run:
+        security_context = SecurityContextHolder.getContext()
+
+        def run_push_job(job):
+            # the XL Release APIs check the permissions of the user who started the job
+            SecurityContextHolder.setContext(security_context)
+            try:
+                result = run_push(job.report)
+                if len(targets) == 1:
+                    return result['stats']
+                return dict([(url, target_result['stats']) for url, target_result in result.items()])
+            finally:
+                SecurityContextHolder.clearContext()
+
+        job = start_job(run_push_job)
+        logger.info('Started pushing the configurations in job [%s]' % job.id)
+        response.entity = {'jobId': job.id}
+
+    else:
+        executed_actions = run_push(None)
 
-    logger.info('Finished pushing the configurations: %s' % executed_actions)
+        logger.info('Finished pushing the configurations: %s' % executed_actions)
 
-    response.entity = executed_actions
+        response.entity = executed_actions
 
 else:
     response.statusCode = 400
-    if not xlr_server_name:
+    if not xlr_server_names:
         response.entity = 'Missing required query parameter "targetXlrName" with the name of xlrconfig.XLReleaseServer'
-    elif not xlr_server:
+    elif missing_xlr_server_names:
         response.entity = 'Cannot find configuration by type [xlrconfig.XLReleaseServer] and title [%s]' \
-                          % xlr_server_name
+                          % missing_xlr_server_names[0]
     elif not push_config:
-        response.entity = 'Missing POST body with the JSON specification of what needs to be pushed'
\ No newline at end of file
+        response.entity = 'Missing POST body with the JSON specification of what needs to be pushed'
@@ -0,0 +1,38 @@
+from xlrconfig import get_storage_directory
+import json
+import os
+import tempfile
+import threading
+
+
+# Number of actions, warnings and errors of each kind kept in the result of a spooled push
+DEFAULT_MAX_ITEMS = 100
+
+
+class PushLog:
+    """Actions, warnings and errors of a push, written one JSON object per line as soon as they are added, in the
+    same format as the events of a push job, so that the result of a large push doesn't have to be kept in memory."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'a')
+        self._lock = threading.Lock()
+
+    def write(self, item_type, item):
+        line = json.dumps({'type': item_type, 'value': item})
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def create_push_log(push_spec):
+    """Creates a new log in the storage directory if the spooled mode is enabled, or returns None."""
+    if not push_spec.get('spool', {}).get('enabled', False):
+        return None
+    handle, file_name = tempfile.mkstemp(prefix='push-log-', suffix='.ndjson', dir=get_storage_directory(push_spec))
+    os.close(handle)
+    return PushLog(file_name)
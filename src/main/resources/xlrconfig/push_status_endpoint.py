@@ -0,0 +1,29 @@
+from com.xebialabs.deployit.security import Permissions
+from xlrconfig.jobs import get_job
+# reload(xlrconfig) uncomment this for faster development cycle
+import json
+
+if Permissions.getAuthenticatedUserName() != 'admin':
+    raise Exception('This endpoint is used for testing purposes and can only be invoked by user [admin], '
+                    'but current user is [%s]' % Permissions.getAuthenticatedUserName())
+
+
+job_id = request.query.get('jobId')
+cursor = int(request.query.get('cursor') or 0)
+compact = request.query.get('compact', '').lower() == 'true'
+
+job = get_job(job_id) if job_id else None
+
+if job:
+    # read the status first, so that all events of a finished job are returned
+    status = job.status
+    events, next_cursor = job.read_events(cursor, compact)
+    header = {'type': 'job', 'value': {'jobId': job.id, 'status': status, 'nextCursor': next_cursor}}
+    response.entity = ''.join([json.dumps(event) + '\n' for event in [header] + events])
+
+else:
+    response.statusCode = 400 if not job_id else 404
+    if not job_id:
+        response.entity = 'Missing required query parameter "jobId" with the ID returned by /xlrconfig/push?async=true'
+    else:
+        response.entity = 'Cannot find push job [%s], it may have been finished long ago' % job_id
@@ -0,0 +1,104 @@
+class ReferenceGraph:
+    """Templates to push with their references to other templates and to configurations, indexed once after
+    the discovery, so that every planning step takes time linear in the number of templates and references.
+    The details stay plain dictionaries, as they are reported as the entities of the actions. Templates which
+    turn out not to be pushed are removed, the indexes then return only the remaining ones."""
+
+    def __init__(self, templates_details):
+        self._templates = []  # _TemplateNode, in the order of the discovery
+        self._references = []  # _ReferenceNode, in the order of their first reference
+        self._configurations = []  # _ConfigurationNode, in the order of their first use
+        references_by_id = {}
+        configurations_by_id = {}
+        for details in templates_details:
+            template = _TemplateNode(details)
+            self._templates.append(template)
+            for ref in details['referenced_templates']:
+                reference = references_by_id.get(ref['id'])
+                if reference is None:
+                    reference = references_by_id[ref['id']] = _ReferenceNode(ref['id'])
+                    self._references.append(reference)
+                reference.details.append(ref)
+                if not reference.referrers or reference.referrers[-1] is not template:
+                    reference.referrers.append(template)
+            for config in details['referenced_configurations']:
+                configuration = configurations_by_id.get(config['id'])
+                if configuration is None:
+                    configuration = configurations_by_id[config['id']] = _ConfigurationNode(config['id'])
+                    self._configurations.append(configuration)
+                configuration.details.append(config)
+                if not configuration.users or configuration.users[-1] is not template:
+                    configuration.users.append(template)
+
+    def get_templates(self):
+        return [template.details for template in self._templates if not template.removed]
+
+    def get_templates_and_references(self):
+        """Returns the details of the remaining templates and of every reference from them to another template.
+        Both have the local path and get the remote folder and template IDs."""
+        return self.get_templates() + [ref for reference in self._references
+                                       if _any_remaining(reference.referrers) for ref in reference.details]
+
+    def get_configurations(self):
+        """Returns the details of every reference from the remaining templates to a configuration."""
+        return [config for configuration in self._configurations
+                if _any_remaining(configuration.users) for config in configuration.details]
+
+    def get_configurations_by_id(self):
+        """Returns the first details of each configuration used by the remaining templates, in the order of use."""
+        return [(configuration.configuration_id, configuration.details[0]) for configuration in self._configurations
+                if _any_remaining(configuration.users)]
+
+    def get_missing_referenced_templates(self):
+        """Returns (reference details, details of the referencing templates) of every template which is referenced
+        by the remaining templates, is not pushed with them, and has not been found on the remote instance."""
+        pushed_template_ids = set([template.details['id'] for template in self._templates if not template.removed])
+        missing = []
+        for reference in self._references:
+            referrers = [template.details for template in reference.referrers if not template.removed]
+            if referrers and reference.template_id not in pushed_template_ids and \
+                    not reference.details[-1]['remote_template_id']:
+                missing.append((reference.details[-1], referrers))
+        return missing
+
+    def remove(self, predicate):
+        """Removes the remaining templates for which the predicate returns True, and returns their details."""
+        removed = []
+        for template in self._templates:
+            if not template.removed and predicate(template.details):
+                template.removed = True
+                removed.append(template.details)
+        return removed
+
+
+class _TemplateNode(object):
+    __slots__ = ['details', 'removed']
+
+    def __init__(self, details):
+        self.details = details
+        self.removed = False
+
+
+class _ReferenceNode(object):
+    __slots__ = ['template_id', 'details', 'referrers']
+
+    def __init__(self, template_id):
+        self.template_id = template_id
+        self.details = []  # one per referencing task
+        self.referrers = []  # _TemplateNode, each once
+
+
+class _ConfigurationNode(object):
+    __slots__ = ['configuration_id', 'details', 'users']
+
+    def __init__(self, configuration_id):
+        self.configuration_id = configuration_id
+        self.details = []  # one per referencing template, possibly the same dictionary
+        self.users = []  # _TemplateNode, each once
+
+
+def _any_remaining(templates):
+    for template in templates:
+        if not template.removed:
+            return True
+    return False
@@ -0,0 +1,68 @@
+from xlrconfig import get_parent
+import time
+
+
+class RemoteIndex:
+    """In-memory index of the folders, templates and configurations of the remote instance,
+    built with a few bulk listing requests instead of a lookup per entity."""
+
+    def __init__(self):
+        self.folder_path_to_id = {}
+        self.folder_id_to_template_title_to_id = {}
+        self.type_title_to_configuration_ids = {}
+        self.indexed_configuration_types = set()
+        self.folder_id_to_duplicate_titles = {}
+        self.stale_folder_ids = set()
+        self.build_time = 0.0
+
+    def add_folders(self, folders, parent_path=None):
+        for folder in folders:
+            path = '%s/%s' % (parent_path, folder['title']) if parent_path else folder['title']
+            self.folder_path_to_id[path] = folder['id']
+            self.add_folders(folder.get('children', []), path)
+
+    def add_templates(self, templates):
+        for template in templates:
+            folder_id = get_parent(template['id'])
+            titles_to_ids = self.folder_id_to_template_title_to_id.setdefault(folder_id, {})
+            if template['title'] in titles_to_ids:
+                # reported only when the folder is used, see get_folder_templates()
+                self.folder_id_to_duplicate_titles.setdefault(folder_id, []).append(template['title'])
+            else:
+                titles_to_ids[template['title']] = template['id']
+
+    def add_configurations(self, config_type, configurations):
+        self.indexed_configuration_types.add(config_type)
+        for configuration in configurations:
+            self.type_title_to_configuration_ids.setdefault((config_type, configuration['title']), []).append(
+                configuration['id'])
+
+    def get_folder_id(self, path):
+        return self.folder_path_to_id.get(path, None)
+
+    def get_folder_templates(self, folder_id, warnings):
+        """Returns the template titles to IDs of a folder, or None if they have to be fetched again."""
+        if folder_id in self.stale_folder_ids:
+            return None
+        titles_to_ids = self.folder_id_to_template_title_to_id.get(folder_id, {})
+        for title in self.folder_id_to_duplicate_titles.pop(folder_id, []):
+            warnings.append('Found more than one template by title [%s] in remote folder [%s], choosing '
+                            'the first one: [%s]' % (title, folder_id, titles_to_ids[title]))
+        return titles_to_ids
+
+    def forget_folder_templates(self, folder_id):
+        self.stale_folder_ids.add(folder_id)
+
+    def get_configuration_ids(self, config_type, config_title):
+        return self.type_title_to_configuration_ids.get((config_type, config_title), [])
+
+    def add_build_time(self, start_time):
+        self.build_time += time.time() - start_time
+
+    def get_stats(self):
+        return {
+            'remote_index_build_seconds': round(self.build_time, 3),
+            'n_remote_index_folders': len(self.folder_path_to_id),
+            'n_remote_index_templates': sum([len(t) for t in self.folder_id_to_template_title_to_id.values()]),
+            'n_remote_index_configurations': sum([len(c) for c in self.type_title_to_configuration_ids.values()])
+        }
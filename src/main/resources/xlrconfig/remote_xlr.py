@@ -1,17 +1,84 @@
 from com.xebialabs.xlrelease.plugin.webhook import XmlPathResult
 from xlrelease.HttpRequest import HttpRequest
+from xlrconfig.concurrency import parallel_map
+from xlrconfig.http_session import HttpSession, StreamedBody, DEFAULT_KEEP_ALIVE
+from xlrconfig.instrumentation import Instrumentation
+from xlrconfig.lookup_cache import CacheStore, MISSING
+from xlrconfig.remote_index import RemoteIndex
 import json
+import threading
+import time
 import urllib
 
 
+# How much of a failed request body and of its response is written to the log
+LOGGED_BODY_PREFIX_LENGTH = 1000
+
+# Unsupported Media Type, the answer to a request body with an unsupported content encoding
+UNSUPPORTED_MEDIA_TYPE = 415
+
+# Too Many Requests, Bad Gateway, Service Unavailable, Gateway Timeout
+RETRYABLE_STATUSES = [429, 502, 503, 504]
+REJECTED_STATUSES = [429, 503]
+
+# Endpoints updating the parts of a template, by the kind of the part
+UPDATE_CONTEXTS = {
+    'template': '/api/v1/templates/%s',
+    'phase': '/api/v1/phases/%s',
+    'task': '/api/v1/tasks/%s',
+    'variable': '/api/v1/templates/%s'
+}
+
+
+class RemoteRequestError(Exception):
+    """Unsuccessful response of the remote instance, with its HTTP status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+    def is_retryable(self):
+        """Tells if the remote instance or a proxy in front of it is overloaded or unavailable, so the same request
+        may succeed later. Other errors, like 500 on a bad template, would fail again."""
+        return self.status in RETRYABLE_STATUSES
+
+    def is_rejected(self):
+        """Tells if the request has certainly not been processed."""
+        return self.status in REJECTED_STATUSES
+
+
 class RemoteXlr:
-    def __init__(self, server, username, password):
+    def __init__(self, server, username, password, options=None, cache_store=None, instrumentation=None):
         self.server = server
         self.username = username
         self.password = password
-        self.folder_path_to_id_cache = {}
-        self.configuration_type_title_to_id_cache = {}
-        self.folder_id_to_template_title_to_id_cache = {}
+        options = options or {}
+        # number of lookup requests sent to the remote instance at the same time
+        self.parallelism = options.get('parallelism', 1)
+        # timeouts of lookup and import requests, in seconds, only applied by the pooled session
+        self.timeout = options.get('timeout', 60)
+        self.import_timeout = options.get('importTimeout', 600)
+        # whether to use a pooled keep-alive session instead of xlrelease.HttpRequest
+        if options.get('session', False) and HttpSession.supports(server):
+            self.session = HttpSession(server, username, password, self.timeout,
+                                       options.get('keepAliveSeconds', DEFAULT_KEEP_ALIVE))
+        else:
+            self.session = None
+        # whether to gzip the import request bodies, which needs the pooled session to stream them
+        self.compress_imports = options.get('compressImports', False) and self.session is not None
+        self.n_import_bytes = 0
+        self.n_import_bytes_sent = 0
+        self._import_bytes_lock = threading.Lock()
+        # whether to index all folders, templates and configurations of the remote instance with bulk requests
+        self.use_index = options.get('index', False)
+        self.index_page_size = options.get('indexPageSize', 500)
+        self.index = None
+        self._index_lock = threading.Lock()
+        self.cache_store = cache_store or CacheStore()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.folder_path_to_id_cache = self.cache_store.get_cache('folder_path_to_id')
+        self.configuration_type_title_to_id_cache = self.cache_store.get_cache('configuration_type_title_to_id')
+        self.folder_id_to_template_title_to_id_cache = self.cache_store.get_cache('folder_id_to_template_title_to_id')
 
     def get_xlr_details(self):
         response = self._request().get('/server/info', contentType='application/xml')
@@ -25,9 +92,66 @@ class RemoteXlr:
             raise Exception('Version request to /server/info failed with status %d, response: %s' %
                             (response.getStatus(), response.response))
 
+    def get_folder_ids_by_paths(self, paths):
+        paths = sorted(set(paths))
+        return dict(zip(paths, parallel_map(self.get_folder_id_by_path, paths, self.parallelism)))
+
+    def build_index(self):
+        """Indexes all folders and templates of the remote instance. Configurations are indexed later,
+        when their types are known."""
+        start_time = time.time()
+        index = RemoteIndex()
+        index.add_folders(self._get_all_pages('/api/v1/folders/list', 'depth=1000', 'folders'))
+        index.add_templates(self._get_all_pages('/api/v1/templates', 'depth=1', 'templates'))
+        index.add_build_time(start_time)
+        self.index = index
+        print('Indexed %d folders and %d templates of the remote instance in %.1f seconds' % (
+            len(index.folder_path_to_id), index.get_stats()['n_remote_index_templates'], index.build_time))
+
+    def _get_all_pages(self, context, query, entities_name):
+        """Fetches all pages of a listing, several pages at a time when parallelism is configured."""
+        def get_page(page):
+            page_query = '?page=%d&resultsPerPage=%d&%s' % (page, self.index_page_size, query)
+            response = self._request().get(context + page_query, contentType='application/json')
+            if not response.isSuccessful():
+                raise Exception('Request to get page %d of remote %s failed with status %d, response: %s'
+                                % (page, entities_name, response.getStatus(), response.response))
+            return json.loads(response.response)
+
+        entities = []
+        first_page = 0
+        while True:
+            pages = parallel_map(get_page, range(first_page, first_page + self.parallelism), self.parallelism)
+            for page in pages:
+                if not page:
+                    # pagination finished
+                    return entities
+                entities.extend(page)
+            first_page += self.parallelism
+
+    def _index_configuration_types(self, config_types):
+        def get_configurations(config_type):
+            query = '?configurationType=%s' % urllib.quote(config_type)
+            response = self._request().get('/api/v1/config/byTypeAndTitle' + query, contentType='application/json')
+            if not response.isSuccessful():
+                raise Exception('Request to find configurations of type [%s] failed with status %d, response: %s' %
+                                (config_type, response.getStatus(), response.response))
+            return json.loads(response.response)
+
+        with self._index_lock:
+            config_types = sorted(set(config_types) - self.index.indexed_configuration_types)
+            start_time = time.time()
+            for config_type, configurations in zip(config_types, parallel_map(get_configurations, config_types,
+                                                                              self.parallelism)):
+                self.index.add_configurations(config_type, configurations)
+            self.index.add_build_time(start_time)
+
     def get_folder_id_by_path(self, path):
-        if path in self.folder_path_to_id_cache:
-            return self.folder_path_to_id_cache[path]
+        if self.index:
+            return self.index.get_folder_id(path)
+        folder_id = self.folder_path_to_id_cache.get(path)
+        if folder_id is not MISSING:
+            return folder_id
         query = '?byPath=%s' % urllib.quote(path)
         response = self._request().get('/api/v1/folders/find' + query, contentType='application/json')
         if response.isSuccessful():
@@ -37,37 +161,79 @@ class RemoteXlr:
         else:
             raise Exception('Request to find a folder [%s] failed with status %d, response: %s' %
                             (path, response.getStatus(), response.response))
-        self.folder_path_to_id_cache[path] = folder_id
+        self.folder_path_to_id_cache.put(path, folder_id)
         return folder_id
 
+    def get_configuration_ids_by_types_and_titles(self, types_and_titles, warnings):
+        types_and_titles = sorted(set(types_and_titles))
+        if self.index:
+            self._index_configuration_types([config_type for config_type, config_title in types_and_titles])
+        return dict(zip(types_and_titles, self._parallel_map_with_warnings(
+            lambda type_and_title, lookup_warnings: self.get_configuration_id_by_type_and_title(
+                type_and_title[0], type_and_title[1], lookup_warnings),
+            types_and_titles, warnings)))
+
     def get_configuration_id_by_type_and_title(self, config_type, config_title, warnings):
         path = '%s/%s' % (config_type, config_title)
-        if path in self.configuration_type_title_to_id_cache:
-            return self.configuration_type_title_to_id_cache[path]
+        configuration_id = self.configuration_type_title_to_id_cache.get(path)
+        if configuration_id is not MISSING:
+            return configuration_id
+        configuration_ids = self._find_configuration_ids(config_type, config_title)
+        if not configuration_ids:
+            configuration_id = None
+        else:
+            if len(configuration_ids) > 1:
+                warnings.append('Found %d configurations by type [%s] and title [%s], choosing the first from: %s' %
+                                (len(configuration_ids), config_type, config_title, configuration_ids))
+            configuration_id = configuration_ids[0]
+        self.configuration_type_title_to_id_cache.put(path, configuration_id)
+        return configuration_id
+
+    def _find_configuration_ids(self, config_type, config_title):
+        if self.index:
+            self._index_configuration_types([config_type])
+            return self.index.get_configuration_ids(config_type, config_title)
         query = '?configurationType=%s&title=%s' % (urllib.quote(config_type), urllib.quote(config_title))
         response = self._request().get('/api/v1/config/byTypeAndTitle' + query, contentType='application/json')
         if response.isSuccessful():
-            configurations = json.loads(response.response)
-            if not configurations:
-                configuration_id = None
-            else:
-                if len(configurations) > 1:
-                    warnings.append('Found %d configurations by type [%s] and title [%s], choosing the first from: %s' %
-                                    (len(configurations), config_type, config_title, [c['id'] for c in configurations]))
-                configuration_id = configurations[0]['id']
+            return [c['id'] for c in json.loads(response.response)]
         else:
             raise Exception('Request to find a configuration [%s/%s] failed with status %d, response: %s' %
                             (config_type, config_title, response.getStatus(), response.response))
-        self.configuration_type_title_to_id_cache[path] = configuration_id
-        return configuration_id
+
+    def load_folders_templates(self, folder_ids, warnings):
+        """Fetches and caches the listings of templates of several folders at once."""
+        self._parallel_map_with_warnings(self._get_folder_templates, sorted(set(folder_ids)), warnings)
 
     def get_template_id_by_folder_and_title(self, folder_id, title, warnings):
-        if folder_id in self.folder_id_to_template_title_to_id_cache:
-            return self.folder_id_to_template_title_to_id_cache[folder_id].get(title, None)
+        return self._get_folder_templates(folder_id, warnings).get(title, None)
+
+    def _get_folder_templates(self, folder_id, warnings):
+        template_titles_to_ids = self.folder_id_to_template_title_to_id_cache.get(folder_id)
+        if template_titles_to_ids is not MISSING:
+            return template_titles_to_ids
+        if self.index:
+            template_titles_to_ids = self.index.get_folder_templates(folder_id, warnings)
+            if template_titles_to_ids is not None:
+                return template_titles_to_ids
 
         # Unfortunately there's no public API to search for a template by folder _and_ title,
         # so iterate through all templates of a folder and cache them
         template_titles_to_ids = {}
+        for template in self.list_folder_templates(folder_id):
+            if template['title'] in template_titles_to_ids:
+                warnings.append('Found more than one template by title [%s] in remote folder [%s], choosing '
+                                'the first one: [%s]' % (template['title'], folder_id,
+                                                         template_titles_to_ids[template['title']]))
+            else:
+                template_titles_to_ids[template['title']] = template['id']
+
+        self.folder_id_to_template_title_to_id_cache.put(folder_id, template_titles_to_ids)
+        return template_titles_to_ids
+
+    def list_folder_templates(self, folder_id):
+        """Returns all templates of a remote folder, with their IDs and titles, bypassing the caches."""
+        templates = []
         context = '/api/v1/folders/%s/templates' % folder_id
         results_per_page = 20
         page = 0
@@ -75,49 +241,162 @@ class RemoteXlr:
             query = '?page=%d&resultsPerPage=%d&depth=1' % (page, results_per_page)
             response = self._request().get(context + query, contentType='application/json')
             if response.isSuccessful():
-                templates = json.loads(response.response)
+                templates_page = json.loads(response.response)
             else:
                 raise Exception('Request to get page %d of templates of folder [%s] failed with status %d, response: %s'
                                 % (page, folder_id, response.getStatus(), response.response))
-            if not templates:
+            if not templates_page:
                 # pagination finished
-                break
-            for template in templates:
-                if template['title'] in template_titles_to_ids:
-                    warnings.append('Found more than one template by title [%s] in remote folder [%s], choosing '
-                                    'the first one: [%s]' % (template['title'], folder_id,
-                                                             template_titles_to_ids[template['title']]))
-                else:
-                    template_titles_to_ids[template['title']] = template['id']
+                return templates
+            templates.extend(templates_page)
             page += 1
 
-        self.folder_id_to_template_title_to_id_cache[folder_id] = template_titles_to_ids
-        return self.folder_id_to_template_title_to_id_cache[folder_id].get(title, None)
+    def get_folder_ids_listed_before(self, folder_ids):
+        """Returns the folders whose cached listings of templates have been fetched by a previous run."""
+        return sorted(set([folder_id for folder_id in folder_ids
+                           if self.folder_id_to_template_title_to_id_cache.is_loaded(folder_id)]))
 
-    def import_template(self, folder_id, template_json, template_path, warnings):
+    def forget_folder_id(self, path):
+        self.folder_path_to_id_cache.remove(path)
+
+    def add_imported_template(self, folder_id, title, template_id):
+        """Keeps the cached listing of a folder up to date, as it may be reused by the next runs."""
+        template_titles_to_ids = self.folder_id_to_template_title_to_id_cache.get(folder_id)
+        if template_titles_to_ids is not MISSING and title not in template_titles_to_ids:
+            template_titles_to_ids = dict(template_titles_to_ids)
+            template_titles_to_ids[title] = template_id
+            self.folder_id_to_template_title_to_id_cache.put(folder_id, template_titles_to_ids)
+
+    def forget_folder_templates(self, folder_id):
+        self.folder_id_to_template_title_to_id_cache.remove(folder_id)
+        if self.index:
+            self.index.forget_folder_templates(folder_id)
+
+    def import_templates(self, folder_id, templates, warnings):
+        """Imports a list of (template JSON, template path) into a folder with one request,
+        returns the list of the imported template IDs in the same order."""
         if folder_id == 'Applications':
             query = ''
         else:
             query = '?folderId=%s' % folder_id
-        body = '[%s]' % template_json  # the import endpoint expects an array of one template
-        response = self._request().post('/api/v1/templates/import' + query, body, contentType='application/json')
+        template_paths = [template_path for template_json, template_path in templates]
+        # the templates are sent one after another as a JSON array, without joining them into one string
+        pieces = ['[']
+        for template_json, template_path in templates:
+            if len(pieces) > 1:
+                pieces.append(',')
+            pieces.append(template_json)
+        pieces.append(']')
+        body = StreamedBody(pieces, self.compress_imports)
+        response = self._post_import(query, body)
+        if body.compress and response.getStatus() == UNSUPPORTED_MEDIA_TYPE:
+            print('The remote instance does not accept compressed imports, sending them uncompressed from now on')
+            self.compress_imports = False
+            body = StreamedBody(pieces)
+            response = self._post_import(query, body)
         if response.isSuccessful():
-            import_result = json.loads(response.response)[0]  # there's always exactly one result
-            import_warnings = filter(lambda w: not w.startswith('Teams in this template have been removed.'),
-                                     import_result.get('warnings', []))
-            if import_warnings:
-                warnings.append('Got following warnings when importing template [%s]: %s' %
-                                (template_path, import_warnings))
-            internal_id = import_result['id']
-            # the import result ID is in internal API format: "Folder1-Release1"
-            public_id = 'Applications/%s' % (internal_id.replace('-', '/'))
-            return public_id
+            import_results = json.loads(response.response)  # one result per template, in the same order
+            if len(import_results) != len(templates):
+                raise Exception('Request to import templates %s returned %d results instead of %d' %
+                                (template_paths, len(import_results), len(templates)))
+            imported_ids = []
+            for template_path, import_result in zip(template_paths, import_results):
+                import_warnings = filter(lambda w: not w.startswith('Teams in this template have been removed.'),
+                                         import_result.get('warnings', []))
+                if import_warnings:
+                    warnings.append('Got following warnings when importing template [%s]: %s' %
+                                    (template_path, import_warnings))
+                internal_id = import_result['id']
+                # the import result ID is in internal API format: "Folder1-Release1"
+                imported_ids.append('Applications/%s' % (internal_id.replace('-', '/')))
+            return imported_ids
         else:
-            logger.info('Request to import template [%s] failed with status %d, response: [%s]. Template JSON: %s'
-                        % (template_path, response.getStatus(), response.response, body))
-            raise Exception('Request to import template [%s] failed with status %d, response: [%s]. '
-                            'Check the log files for more details' %
-                            (template_path, response.getStatus(), response.response))
+            logged_response = (response.response or '')[:LOGGED_BODY_PREFIX_LENGTH]
+            print('Request to import templates %s failed with status %d, response: [%s]. Templates JSON of %d '
+                  'bytes with SHA-1 %s starts with: %s' % (template_paths, response.getStatus(), logged_response,
+                                                           body.get_length(), body.get_digest(),
+                                                           body.get_prefix(LOGGED_BODY_PREFIX_LENGTH)))
+            raise RemoteRequestError(response.getStatus(),
+                                     'Request to import templates %s failed with status %d, response: [%s]. '
+                                     'Check the log files for more details' %
+                                     (template_paths, response.getStatus(), logged_response))
+
+    def _post_import(self, query, body):
+        try:
+            return self._request().post('/api/v1/templates/import' + query, body, contentType='application/json',
+                                        timeout=self.import_timeout)
+        finally:
+            with self._import_bytes_lock:
+                self.n_import_bytes += body.n_bytes
+                self.n_import_bytes_sent += body.n_bytes_sent
+
+    def get_template(self, template_id):
+        """Returns the template with its phases, tasks and variables, parsed from its JSON."""
+        response = self._request().get('/api/v1/templates/%s' % template_id, contentType='application/json')
+        if not response.isSuccessful():
+            raise RemoteRequestError(response.getStatus(), 'Request to get template [%s] failed with status %d, '
+                                     'response: %s' % (template_id, response.getStatus(), response.response))
+        return json.loads(response.response)
+
+    def update_template_part(self, kind, ci):
+        """Updates the template, or one of its phases, tasks or variables, with all properties of the given CI."""
+        response = self._request().put(UPDATE_CONTEXTS[kind] % ci['id'], json.dumps(ci),
+                                       contentType='application/json')
+        if not response.isSuccessful():
+            raise RemoteRequestError(response.getStatus(), 'Request to update %s [%s] failed with status %d, '
+                                     'response: %s' % (kind, ci['id'], response.getStatus(), response.response))
+
+    def _parallel_map_with_warnings(self, function, items, warnings):
+        """Runs function(item, warnings) for all items in parallel. The warnings are collected separately for
+        each item and added in the order of the items, so that the result does not depend on the timing."""
+        def collect_warnings(item):
+            item_warnings = []
+            return function(item, item_warnings), item_warnings
+
+        results = parallel_map(collect_warnings, items, self.parallelism)
+        for result, item_warnings in results:
+            warnings.extend(item_warnings)
+        return [result for result, item_warnings in results]
+
+    def get_stats(self):
+        stats = {}
+        if self.session:
+            session_stats = self.session.get_stats()
+            stats['n_remote_connections_opened'] = session_stats['n_connections_opened']
+            stats['n_remote_requests'] = session_stats['n_requests']
+        if self.index:
+            stats.update(self.index.get_stats())
+        if self.n_import_bytes:
+            stats['n_import_bytes'] = self.n_import_bytes
+            stats['n_import_bytes_sent'] = self.n_import_bytes_sent
+        return stats
+
+    def close(self):
+        if self.session:
+            self.session.close()
+        self.cache_store.save()
 
     def _request(self):
-        return HttpRequest(self.server, self.username, self.password)
+        if self.session:
+            return self.instrumentation.instrument_request(self.session)
+        return self.instrumentation.instrument_request(
+            _HttpRequestWithoutTimeout(HttpRequest(self.server, self.username, self.password)))
+
+
+class _HttpRequestWithoutTimeout:
+    """Adapts xlrelease.HttpRequest, used when the pooled session is disabled or for NTLM authentication,
+    to the interface of HttpSession. Timeouts are not supported by HttpRequest and are ignored."""
+
+    def __init__(self, request):
+        self.request = request
+
+    def get(self, context, contentType=None, timeout=None):
+        return self.request.get(context, contentType=contentType)
+
+    def post(self, context, body, contentType=None, timeout=None):
+        if isinstance(body, StreamedBody):
+            body = body.get_text()
+        return self.request.post(context, body, contentType=contentType)
+
+    def put(self, context, body, contentType=None, timeout=None):
+        return self.request.put(context, body, contentType=contentType)
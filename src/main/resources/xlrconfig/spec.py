@@ -0,0 +1,156 @@
+from xlrconfig import get_parent
+import hashlib
+import json
+import re
+import threading
+
+
+# Characters that have a special meaning in a Python regular expression
+_REGEX_SPECIAL_CHARACTERS = '.^$*+?{}[]\\|()'
+
+# Patterns which cannot be combined with others: group references would point to other groups,
+# and inline flags would apply to all patterns
+_NOT_COMBINABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)')
+
+# Python regular expressions cannot have more than 100 groups
+_MAX_GROUPS = 99
+
+# Number of compiled specifications kept in memory between runs
+_MAX_COMPILED_SPECS = 32
+
+_compiled_specs = {}
+_compiled_specs_lock = threading.Lock()
+
+
+def get_literal_folder_prefix(pattern):
+    """Returns the folder path that all paths matching the given pattern must be located in,
+    e.g. 'XL Deploy/Maintenance' for 'XL Deploy/Maintenance/.*', or None if there's no such folder."""
+    if '|' in pattern:
+        return None  # alternatives may start anywhere
+    literal = []
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            literal.append(pattern[i + 1])  # escaped special character
+            i += 2
+            continue
+        if char in '*?{' and literal:
+            literal.pop()  # the previous character is optional or repeated
+        if char in _REGEX_SPECIAL_CHARACTERS:
+            break
+        literal.append(char)
+        i += 1
+    literal = ''.join(literal)
+    return get_parent(literal) if '/' in literal else None
+
+
+def plan_template_discovery(include_patterns):
+    """Returns the minimal list of folder paths which contain all templates matching the given patterns,
+    or None if some pattern can match templates anywhere, so that all templates have to be scanned."""
+    folder_paths = set()
+    for pattern in include_patterns:
+        folder_path = get_literal_folder_prefix(pattern)
+        if not folder_path:
+            return None
+        folder_paths.add(folder_path)
+    # no need to scan a folder if its parent folder is scanned already
+    return sorted(path for path in folder_paths
+                  if not any(path.startswith(other + '/') for other in folder_paths))
+
+
+def compile_spec(push_spec):
+    """Returns the compiled template inclusion patterns and folder renamings of the push specification.
+    The result is reused by the next runs with the same patterns and renamings."""
+    include_patterns = push_spec['templates']['include']
+    renamings = list(push_spec.get('folders', {}).get('rename', {}).items())
+    key = hashlib.sha1(json.dumps([include_patterns, renamings]).encode('utf-8')).hexdigest()
+    with _compiled_specs_lock:
+        compiled_spec = _compiled_specs.get(key)
+    if compiled_spec is None:
+        compiled_spec = CompiledSpec(include_patterns, renamings)
+        with _compiled_specs_lock:
+            if len(_compiled_specs) >= _MAX_COMPILED_SPECS:
+                _compiled_specs.clear()
+            _compiled_specs[key] = compiled_spec
+    return compiled_spec
+
+
+class CompiledSpec:
+    """Matches template paths against the inclusion patterns and renames their folders. It does not change
+    after it has been created, so it can be shared between threads."""
+
+    def __init__(self, include_patterns, renamings):
+        self._include_regexes, self._separate_include_regexes = _combine_patterns(include_patterns)
+        self._renamings = []  # (compiled pattern, replacement), in the order of the specification
+        self._literal_renamings_trie = {}  # character -> subtrie, None -> index of a renaming ending there
+        self._regex_renamings = []  # (index, compiled pattern) of the renamings which are not literal
+        for index, (pattern, replacement) in enumerate(renamings):
+            self._renamings.append((re.compile('^' + pattern), replacement))
+            if any(char in _REGEX_SPECIAL_CHARACTERS for char in pattern):
+                self._regex_renamings.append((index, self._renamings[-1][0]))
+            else:
+                node = self._literal_renamings_trie
+                for char in pattern:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, index)  # the first of equal renamings wins
+
+    def matches(self, path):
+        # check for full match, so all characters should be part of the pattern
+        if any(regex.match(path) for regex in self._include_regexes):
+            return True
+        for regex in self._separate_include_regexes:
+            match = regex.match(path)
+            if match and match.end() == len(path):
+                return True
+        return False
+
+    def get_remote_path(self, local_path):
+        """Applies the first matching folder renaming to the path, if any. Renamings are not applied several times."""
+        index = self._get_literal_renaming_index(local_path)
+        for regex_index, regex in self._regex_renamings:
+            if index is not None and regex_index > index:
+                break
+            if regex.match(local_path):
+                index = regex_index
+                break
+        if index is None:
+            return local_path
+        regex, replacement = self._renamings[index]
+        return regex.sub(replacement, local_path)
+
+    def _get_literal_renaming_index(self, path):
+        """Returns the first of the literal renamings that the path starts with, walking the trie once."""
+        node = self._literal_renamings_trie
+        index = node.get(None)
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node and (index is None or node[None] < index):
+                index = node[None]
+        return index
+
+
+def _combine_patterns(patterns):
+    """Compiles the patterns into as few regular expressions as possible, which match a path if some of
+    the patterns matches it fully. Returns them with the separately compiled patterns which cannot be combined."""
+    regexes = []
+    separate_regexes = []
+    chunk = []
+    n_chunk_groups = 0
+    for pattern in patterns:
+        regex = re.compile(pattern)  # fails on an invalid pattern, mentioning it
+        n_groups = regex.groups
+        if _NOT_COMBINABLE.search(pattern):
+            separate_regexes.append(regex)
+            continue
+        if chunk and n_chunk_groups + n_groups > _MAX_GROUPS:
+            regexes.append(re.compile('|'.join(chunk)))
+            chunk = []
+            n_chunk_groups = 0
+        chunk.append(r'(?:%s)\Z' % pattern)
+        n_chunk_groups += n_groups
+    if chunk:
+        regexes.append(re.compile('|'.join(chunk)))
+    return regexes, separate_regexes
@@ -0,0 +1,76 @@
+# Collections of child CIs of a template, which are not compared as properties of their parent. Phases, tasks
+# and variables are matched and compared one by one, release triggers, attachments and teams are not updated.
+CHILD_COLLECTIONS = ['phases', 'tasks', 'variables', 'releaseTriggers', 'attachments', 'teams']
+
+
+class TemplateStructureChanged(Exception):
+    """The local template has phases, tasks or variables added, removed, reordered or of another type, compared
+    to the remote one, so it cannot be updated in place."""
+
+
+def match_template_ids(local_template, remote_template):
+    """Returns the remote ID of the template and of each of its phases, tasks and variables by their local ID.
+    Phases and tasks are matched by their position and variables by their key."""
+    ids = {local_template['id']: remote_template['id']}
+    _match_children('phase', local_template, remote_template, ids)
+    local_variables = dict([(v['key'], v) for v in local_template.get('variables', [])])
+    remote_variables = dict([(v['key'], v) for v in remote_template.get('variables', [])])
+    if sorted(local_variables) != sorted(remote_variables):
+        raise TemplateStructureChanged('variables %s have been added or removed' %
+                                       sorted(set(local_variables) ^ set(remote_variables)))
+    for key, local_variable in local_variables.items():
+        _match_ci('variable', local_variable, remote_variables[key], ids)
+    return ids
+
+
+def _match_children(kind, local_parent, remote_parent, ids):
+    local_children = local_parent.get(kind + 's', [])
+    remote_children = remote_parent.get(kind + 's', [])
+    if len(local_children) != len(remote_children):
+        raise TemplateStructureChanged('[%s] has %d %ss instead of %d' % (
+            remote_parent.get('title'), len(local_children), kind, len(remote_children)))
+    for local_child, remote_child in zip(local_children, remote_children):
+        _match_ci(kind, local_child, remote_child, ids)
+        _match_children('task', local_child, remote_child, ids)
+
+
+def _match_ci(kind, local_ci, remote_ci, ids):
+    if local_ci.get('type') != remote_ci.get('type'):
+        raise TemplateStructureChanged('%s [%s] is of type %s instead of %s' % (
+            kind, remote_ci.get('title', remote_ci.get('key')), local_ci.get('type'), remote_ci.get('type')))
+    ids[local_ci['id']] = remote_ci['id']
+
+
+def get_template_updates(local_template, remote_template):
+    """Returns (kind, remote CI) of the template, phases, tasks and variables whose properties differ, in the
+    order of the template. The local template has to be rewritten to the remote IDs, matched by match_template_ids.
+    Each remote CI gets the local values of the changed properties and keeps its other properties."""
+    updates = []
+    _add_update('template', local_template, remote_template, updates)
+    _add_children_updates('phase', local_template.get('phases', []), remote_template.get('phases', []), updates)
+    remote_variables = dict([(v['key'], v) for v in remote_template.get('variables', [])])
+    for local_variable in local_template.get('variables', []):
+        _add_update('variable', local_variable, remote_variables[local_variable['key']], updates)
+    return updates
+
+
+def _add_children_updates(kind, local_children, remote_children, updates):
+    for local_child, remote_child in zip(local_children, remote_children):
+        _add_update(kind, local_child, remote_child, updates)
+        _add_children_updates('task', local_child.get('tasks', []), remote_child.get('tasks', []), updates)
+
+
+def _add_update(kind, local_ci, remote_ci, updates):
+    local_properties = get_properties(local_ci)
+    changed = [name for name, value in local_properties.items() if remote_ci.get(name) != value]
+    if changed:
+        updated_ci = get_properties(remote_ci)
+        updated_ci.update(local_properties)
+        updated_ci['id'] = remote_ci['id']
+        updates.append((kind, updated_ci))
+
+
+def get_properties(ci):
+    """Returns the properties of a CI which are compared and updated, without its ID, metadata and children."""
+    return dict([(name, value) for name, value in ci.items()
+                 if name != 'id' and not name.startswith('$') and name not in CHILD_COLLECTIONS])
@@ -0,0 +1,199 @@
+"""Benchmark of the configuration push, run outside XL Release with Python 2.7 (or Jython 2.7).
+
+Every corpus size is pushed in its own process, from fake local APIs to a local stand-in of the remote
+XL Release server, and the throughput, phase timings and peak memory are reported. The results can be saved
+as a baseline, and are compared with the baseline to catch regressions:
+
+    python src/test/benchmark/benchmark.py --sizes 100,1000,10000 --latency 0.002
+    python src/test/benchmark/benchmark.py --save-baseline
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib2
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, '..', '..', 'main', 'resources')
+DEFAULT_BASELINE_FILE = os.path.join(BENCHMARK_DIRECTORY, 'baseline.json')
+DEFAULT_SIZES = '100,1000,10000'
+
+# Relative change of the throughput or the peak memory above which a result counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks pushing synthetic template corpora.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated numbers of templates, up to 50000')
+    parser.add_argument('--folder-depth', type=int, default=2)
+    parser.add_argument('--folder-width', type=int, default=3)
+    parser.add_argument('--tasks', type=int, default=10, help='number of tasks per template')
+    parser.add_argument('--reference-density', type=float, default=0.1,
+                        help='probability of a task to be a CreateReleaseTask referencing another template')
+    parser.add_argument('--missing-folders', type=float, default=0.1,
+                        help='share of the local folders which are missing on the remote server')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every remote request')
+    parser.add_argument('--spec', default='{"templates": {"include": [".*"]}}', help='push specification JSON')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)  # runs one size in this process
+    return parser.parse_args()
+
+
+def run_single(arguments):
+    """Pushes one corpus and prints the result as JSON on the last line of the output."""
+    import resource
+    sys.path.insert(0, PLUGIN_DIRECTORY)
+    sys.path.insert(0, BENCHMARK_DIRECTORY)
+    import fake_xlr
+    import http_request
+    fake_xlr.install_fake_modules()
+    http_request.install()
+    from corpus import Corpus
+    from xlrconfig.configuration_pusher import push_configuration
+
+    start_time = time.time()
+    corpus = Corpus(n_templates=arguments.single, folder_depth=arguments.folder_depth,
+                    folder_width=arguments.folder_width, tasks_per_template=arguments.tasks,
+                    reference_density=arguments.reference_density,
+                    missing_remote_folder_ratio=arguments.missing_folders)
+    generation_seconds = time.time() - start_time
+    remote_stub, remote_url = start_remote_stub_process(corpus, arguments.latency)
+    apis = {'templateApi': fake_xlr.FakeTemplateApi(corpus), 'folderApi': fake_xlr.FakeFolderApi(corpus),
+            'configurationApi': fake_xlr.FakeConfigurationApi(corpus)}
+    peak_memory_before = _get_peak_memory_mb(resource)
+
+    start_time = time.time()
+    try:
+        result = push_configuration(({'url': remote_url}, 'admin', 'admin'), json.loads(arguments.spec),
+                                    arguments.dry_run, apis)
+        seconds = time.time() - start_time
+        peak_memory = _get_peak_memory_mb(resource)
+        remote_requests = json.loads(urllib2.urlopen(remote_url + 'stub/requests').read())
+    finally:
+        remote_stub.stdin.close()
+        remote_stub.wait()
+
+    stats = result['stats']
+    print(json.dumps({
+        'n_templates': arguments.single,
+        'seconds': round(seconds, 3),
+        'templates_per_second': round(arguments.single / seconds, 1),
+        'corpus_generation_seconds': round(generation_seconds, 3),
+        'phase_seconds': stats.get('phase_seconds', {}),
+        'peak_memory_mb': round(peak_memory, 1),
+        'push_peak_memory_mb': round(peak_memory - peak_memory_before, 1),
+        'n_imported': stats.get('n_imported'),
+        'n_errors': len(result['errors']),
+        'n_warnings': len(result['warnings']),
+        'n_local_calls': sum([sum(api.calls.values()) for api in apis.values()]),
+        'n_remote_requests': sum(remote_requests.values())
+    }, sort_keys=True))
+
+
+def start_remote_stub_process(corpus, latency):
+    """Starts the stand-in of the remote server in another process, so that the templates it keeps are not
+    counted in the peak memory. Returns the process and the URL of the server."""
+    handle, state_file = tempfile.mkstemp(prefix='xlrconfig-benchmark-', suffix='.json')
+    with os.fdopen(handle, 'w') as f:
+        json.dump({'folder_paths': corpus.remote_folder_paths, 'configurations': corpus.remote_configurations}, f)
+    try:
+        process = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIRECTORY, 'remote_stub.py'), state_file,
+                                    '--latency', str(latency)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        port = int(process.stdout.readline())
+    finally:
+        os.remove(state_file)
+    return process, 'http://127.0.0.1:%d/' % port
+
+
+def _get_peak_memory_mb(resource):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_memory / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_memory / 1024.0
+
+
+def run_size(arguments, size):
+    command = [sys.executable, os.path.abspath(__file__), '--single', str(size)]
+    for name in ['folder_depth', 'folder_width', 'tasks', 'reference_density', 'missing_folders', 'latency', 'spec']:
+        command += ['--%s' % name.replace('_', '-'), str(getattr(arguments, name))]
+    if arguments.dry_run:
+        command.append('--dry-run')
+    output = subprocess.check_output(command).decode('utf-8')
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def get_settings(arguments):
+    """Returns the parameters which have to be equal for results to be compared with the baseline."""
+    return dict([(name, getattr(arguments, name)) for name in
+                 ['folder_depth', 'folder_width', 'tasks', 'reference_density', 'missing_folders', 'latency',
+                  'spec', 'dry_run']])
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for result in results:
+        expected = baseline.get(str(result['n_templates']))
+        if not expected:
+            continue
+        if result['templates_per_second'] < expected['templates_per_second'] * (1 - tolerance):
+            regressions.append('%d templates: %.1f templates per second, the baseline is %.1f' % (
+                result['n_templates'], result['templates_per_second'], expected['templates_per_second']))
+        if result['push_peak_memory_mb'] > max(expected['push_peak_memory_mb'], 1) * (1 + tolerance):
+            regressions.append('%d templates: the push increased the peak memory by %.1f MB, the baseline is %.1f' % (
+                result['n_templates'], result['push_peak_memory_mb'], expected['push_peak_memory_mb']))
+        if result['n_imported'] != expected['n_imported']:
+            regressions.append('%d templates: %s templates imported, the baseline is %s' % (
+                result['n_templates'], result['n_imported'], expected['n_imported']))
+    return regressions
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.single:
+        run_single(arguments)
+        return 0
+
+    results = []
+    for size in [int(size) for size in arguments.sizes.split(',')]:
+        result = run_size(arguments, size)
+        results.append(result)
+        print('%6d templates: %7.2f s, %8.1f templates/s, peak memory %6.1f MB (+%.1f MB by the push), '
+              '%d remote requests' % (size, result['seconds'], result['templates_per_second'],
+                                      result['peak_memory_mb'], result['push_peak_memory_mb'],
+                                      result['n_remote_requests']))
+        print('        phases: %s' % ', '.join(['%s %.3f s' % phase for phase in
+                                                 sorted(result['phase_seconds'].items())]))
+
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'w') as f:
+            json.dump({'settings': get_settings(arguments),
+                       'results': dict([(str(result['n_templates']), result) for result in results])},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved the baseline to %s' % arguments.baseline)
+        return 0
+
+    if not os.path.exists(arguments.baseline):
+        print('No baseline found in %s, use --save-baseline to create it' % arguments.baseline)
+        return 0
+    with open(arguments.baseline) as f:
+        baseline = json.load(f)
+    if baseline['settings'] != get_settings(arguments):
+        print('The baseline was measured with other settings, not comparing: %s' % json.dumps(baseline['settings']))
+        return 0
+    regressions = find_regressions(results, baseline['results'], arguments.tolerance)
+    for regression in regressions:
+        print('REGRESSION: %s' % regression)
+    if not regressions:
+        print('No regressions compared to the baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Generator of synthetic local template corpora and matching remote instance state."""
+import random
+
+from fake_xlr import FakeCi, FakeFolder, FakePhase, FakeTemplate
+
+
+class Corpus(object):
+    def __init__(self, n_templates=100, folder_depth=2, folder_width=3, tasks_per_template=10,
+                 reference_density=0.1, n_configurations=20, missing_remote_folder_ratio=0.0, seed=42):
+        rnd = random.Random(seed)
+        self.folders = {}
+        self.folders_list = []
+        self.folder_ids_by_path = {}
+        self.templates = {}
+        self.templates_list = []
+        self.templates_by_folder = {}
+        self.configurations = {}
+        self.paths = {}
+
+        counter = [0]
+
+        def next_id(prefix):
+            counter[0] += 1
+            return '%s%d' % (prefix, counter[0])
+
+        def add_folders(parent_id, parent_path, depth):
+            if depth == 0:
+                return []
+            created = []
+            for i in range(folder_width):
+                folder_id = '%s/%s' % (parent_id, next_id('Folder'))
+                title = 'Folder %d-%d' % (depth, i)
+                path = '%s/%s' % (parent_path, title) if parent_path else title
+                folder = FakeFolder(folder_id, title)
+                self.folders[folder_id] = folder
+                self.folders_list.append(folder)
+                self.folder_ids_by_path[path] = folder_id
+                self.paths[folder_id] = path
+                if parent_id in self.folders:
+                    self.folders[parent_id].children.append(folder)
+                created.append(folder_id)
+                created.extend(add_folders(folder_id, path, depth - 1))
+            return created
+
+        folder_ids = add_folders('Applications', '', folder_depth)
+
+        for i in range(n_configurations):
+            config_id = 'Configuration/Custom/Configuration%d' % i
+            self.configurations[config_id] = FakeCi(config_id, 'jenkins.Server', 'Jenkins %d' % i)
+        config_ids = sorted(self.configurations)
+
+        template_ids = []
+        for i in range(n_templates):
+            folder_id = folder_ids[i % len(folder_ids)]
+            template_id = '%s/%s' % (folder_id, next_id('Release'))
+            phases = []
+            n_phases = max(1, tasks_per_template // 5)
+            task_index = 0
+            for p in range(n_phases):
+                phase_id = '%s/%s' % (template_id, next_id('Phase'))
+                tasks = []
+                for _ in range(max(1, tasks_per_template // n_phases)):
+                    task_id = '%s/%s' % (phase_id, next_id('Task'))
+                    if template_ids and rnd.random() < reference_density:
+                        target = rnd.choice(template_ids)
+                        tasks.append(FakeCi(task_id, 'xlrelease.CreateReleaseTask', 'Create release %d' % task_index,
+                                            templateId=target, newReleaseTitle='Release ${version}'))
+                    elif config_ids and rnd.random() < 0.3:
+                        tasks.append(FakeCi(task_id, 'jenkins.Build', 'Build %d' % task_index,
+                                            jenkinsServer=self.configurations[rnd.choice(config_ids)],
+                                            jobName='job-%d' % task_index))
+                    else:
+                        tasks.append(FakeCi(task_id, 'xlrelease.Task', 'Manual task %d' % task_index,
+                                            description='Do something manually ' * 5))
+                    task_index += 1
+                phases.append(FakePhase(phase_id, 'Phase %d' % p, tasks))
+            template = FakeTemplate(template_id, 'Template %d' % i, phases)
+            self.templates[template_id] = template
+            self.templates_list.append(template)
+            self.templates_by_folder.setdefault(folder_id, []).append(template)
+            self.paths[template_id] = '%s/%s' % (self.paths[folder_id], template.getTitle())
+            template_ids.append(template_id)
+
+        self.remote_folder_paths = [p for p in sorted(self.folder_ids_by_path)
+                                    if rnd.random() >= missing_remote_folder_ratio]
+        self.remote_configurations = [(c.getType().toString(), c.getTitle()) for c in
+                                      [self.configurations[i] for i in config_ids]]
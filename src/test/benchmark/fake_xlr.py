@@ -0,0 +1,237 @@
+"""In-process stand-ins for the XL Release Jython environment: fake local APIs and Java modules."""
+import json
+import sys
+import types
+
+
+class NotFoundException(Exception):
+    pass
+
+
+def install_fake_modules(server_url='http://localhost:5516/'):
+    def module(name, **attrs):
+        m = sys.modules.get(name) or types.ModuleType(name)
+        for k, v in attrs.items():
+            setattr(m, k, v)
+        sys.modules[name] = m
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(module(parent), child, m)
+        return m
+
+    class CurrentVersion(object):
+        @staticmethod
+        def get():
+            return '8.0.0'
+
+    class _ServerConfiguration(object):
+        def getServerUrl(self):
+            return server_url
+
+    class ServerConfiguration(object):
+        @staticmethod
+        def getInstance():
+            return _ServerConfiguration()
+
+    class CiSerializerHelper(object):
+        @staticmethod
+        def serialize(ci):
+            return json.dumps(ci.to_dict())
+
+    module('com.xebialabs.deployit.plumbing', CurrentVersion=CurrentVersion)
+    module('com.xebialabs.deployit', ServerConfiguration=ServerConfiguration)
+    module('com.xebialabs.deployit.exception', NotFoundException=NotFoundException)
+    module('com.xebialabs.xlrelease.json', CiSerializerHelper=CiSerializerHelper)
+
+
+class FakeType(object):
+    def __init__(self, name, ci=None):
+        self.name = name
+        self.ci = ci
+
+    def toString(self):
+        return self.name
+
+    __str__ = toString
+
+    def getDescriptor(self):
+        return FakeDescriptor(self.ci)
+
+
+class FakeKind(object):
+    def __init__(self, name):
+        self.name = name
+
+    def toString(self):
+        return self.name
+
+
+class FakePropertyDescriptor(object):
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = FakeKind(kind)
+
+    def getName(self):
+        return self.name
+
+    def getKind(self):
+        return self.kind
+
+    def get(self, ci):
+        return ci.properties.get(self.name)
+
+
+class FakeDescriptor(object):
+    def __init__(self, ci):
+        self.ci = ci
+
+    def getPropertyDescriptors(self):
+        return [FakePropertyDescriptor(name, 'CI' if isinstance(value, FakeCi) else 'STRING')
+                for name, value in sorted(self.ci.properties.items())]
+
+
+class FakeCi(object):
+    _delegate = None
+
+    def __init__(self, ci_id, ci_type, title, **properties):
+        self.id = ci_id
+        self.type = FakeType(ci_type, self)
+        self.title = title
+        self.properties = properties
+        self.attachments = []
+        self.facets = []
+
+    def getId(self):
+        return self.id
+
+    def getTitle(self):
+        return self.title
+
+    def getType(self):
+        return self.type
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def getAttachments(self):
+        return self.attachments
+
+    def setAttachments(self, attachments):
+        self.attachments = attachments
+
+    def getFacets(self):
+        return self.facets
+
+    def to_dict(self):
+        d = {'id': self.id, 'type': self.type.name, 'title': self.title}
+        for k, v in self.properties.items():
+            d[k] = v.getId() if isinstance(v, FakeCi) else v
+        return d
+
+
+class FakeTemplate(FakeCi):
+    def __init__(self, ci_id, title, phases, variables=(), triggers=()):
+        FakeCi.__init__(self, ci_id, 'xlrelease.Release', title)
+        self.phases = phases
+        self.variables = list(variables)
+        self.triggers = list(triggers)
+
+    def getPhases(self):
+        return self.phases
+
+    def getAllTasks(self):
+        return [t for p in self.phases for t in p.tasks]
+
+    def getVariables(self):
+        return self.variables
+
+    def getReleaseTriggers(self):
+        return self.triggers
+
+    def to_dict(self):
+        d = FakeCi.to_dict(self)
+        d['phases'] = [dict(FakeCi.to_dict(p), tasks=[t.to_dict() for t in p.tasks]) for p in self.phases]
+        d['variables'] = [v.to_dict() for v in self.variables]
+        d['attachments'] = [a.to_dict() for a in self.attachments]
+        return d
+
+
+class FakePhase(FakeCi):
+    def __init__(self, ci_id, title, tasks):
+        FakeCi.__init__(self, ci_id, 'xlrelease.Phase', title)
+        self.tasks = tasks
+
+
+class FakeFolder(FakeCi):
+    def __init__(self, ci_id, title):
+        FakeCi.__init__(self, ci_id, 'xlrelease.Folder', title)
+        self.children = []
+
+    def getChildren(self):
+        return self.children
+
+
+class CallCounter(object):
+    def __init__(self):
+        self.calls = {}
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+
+class FakeTemplateApi(CallCounter):
+    def __init__(self, corpus):
+        CallCounter.__init__(self)
+        self.corpus = corpus
+
+    def getTemplates(self, title, tags, page, results_per_page, depth):
+        self.count('templateApi.getTemplates')
+        start = page * results_per_page
+        return self.corpus.templates_list[start:start + results_per_page]
+
+    def getTemplate(self, template_id):
+        self.count('templateApi.getTemplate')
+        if template_id not in self.corpus.templates:
+            raise NotFoundException('Template [%s] not found' % template_id)
+        return self.corpus.templates[template_id]
+
+
+class FakeFolderApi(CallCounter):
+    def __init__(self, corpus):
+        CallCounter.__init__(self)
+        self.corpus = corpus
+
+    def getFolder(self, folder_id):
+        self.count('folderApi.getFolder')
+        if folder_id not in self.corpus.folders:
+            raise NotFoundException('Folder [%s] not found' % folder_id)
+        return self.corpus.folders[folder_id]
+
+    def find(self, path, depth):
+        self.count('folderApi.find')
+        folder_id = self.corpus.folder_ids_by_path.get(path)
+        if not folder_id:
+            raise NotFoundException('Folder [%s] not found' % path)
+        return self.corpus.folders[folder_id]
+
+    def listRoot(self, page, results_per_page, depth, decorate_with_permissions):
+        self.count('folderApi.listRoot')
+        roots = [f for f in self.corpus.folders_list if f.getId().count('/') == 1]
+        start = (page or 0) * (results_per_page or len(roots) or 1)
+        return roots[start:start + (results_per_page or len(roots))]
+
+    def getTemplates(self, folder_id, page, results_per_page, depth):
+        self.count('folderApi.getTemplates')
+        templates = self.corpus.templates_by_folder.get(folder_id, [])
+        start = page * results_per_page
+        return templates[start:start + results_per_page]
+
+
+class FakeConfigurationApi(CallCounter):
+    def __init__(self, corpus):
+        CallCounter.__init__(self)
+        self.corpus = corpus
+
+    def getConfiguration(self, configuration_id):
+        self.count('configurationApi.getConfiguration')
+        return self.corpus.configurations[configuration_id]
@@ -0,0 +1,235 @@
+"""Local HTTP stand-in of a remote XL Release instance, with configurable latency and injected failures:
+fail_next 503 responses to imports, 400 for templates titled FAIL, and 415 for gzip bodies with reject_gzip."""
+import argparse
+import gzip
+import io
+import json
+import sys
+import threading
+import time
+import zlib
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+class RemoteState(object):
+    def __init__(self, folder_paths=(), configurations=()):
+        self.lock = threading.Lock()
+        self.counter = 1000
+        self.folder_ids_by_path = {}
+        self.folders = {}  # id -> (title, parent_id)
+        self.templates = {}  # id -> template dict
+        self.configurations = {}  # id -> (type, title)
+        self.requests = {}
+        for path in sorted(folder_paths):
+            self.add_folder(path)
+        for config_type, title in configurations:
+            self.configurations['Configuration/Custom/Configuration%d' % self._next()] = (config_type, title)
+
+    def _next(self):
+        self.counter += 1
+        return self.counter
+
+    def add_folder(self, path):
+        parent_path, _, title = path.rpartition('/')
+        parent_id = self.folder_ids_by_path.get(parent_path, 'Applications') if parent_path else 'Applications'
+        folder_id = '%s/Folder%d' % (parent_id, self._next())
+        self.folder_ids_by_path[path] = folder_id
+        self.folders[folder_id] = (title, parent_id)
+        return folder_id
+
+    def count(self, key):
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1  # send the headers and the body together
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _reply(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        headers = {'Content-Type': content_type}
+        if 'gzip' in (self.headers.get('Accept-Encoding') or '') and len(body) > 256:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if self.server.reject_gzip:
+                return None
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        self._delay()
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        state = self.state
+        if url.path == '/stub/requests':
+            return self._reply(200, json.dumps(state.requests))  # not counted, used by the benchmark
+        if url.path == '/server/info':
+            state.count('GET /server/info')
+            return self._reply(200, '<server-info><version>8.0.0</version></server-info>', 'application/xml')
+        if url.path == '/api/v1/folders/find':
+            state.count('GET /api/v1/folders/find')
+            folder_id = state.folder_ids_by_path.get(query.get('byPath'))
+            if not folder_id:
+                return self._reply(404, '{"error": "not found"}')
+            return self._reply(200, json.dumps({'id': folder_id, 'title': state.folders[folder_id][0]}))
+        if url.path == '/api/v1/folders/list':
+            state.count('GET /api/v1/folders/list')
+            return self._reply(200, json.dumps(self._page(self._folder_tree('Applications'), query)))
+        if url.path == '/api/v1/config/byTypeAndTitle':
+            state.count('GET /api/v1/config/byTypeAndTitle')
+            found = [{'id': i, 'type': t, 'title': title} for i, (t, title) in sorted(state.configurations.items())
+                     if t == query.get('configurationType') and
+                     ('title' not in query or title == query.get('title'))]
+            return self._reply(200, json.dumps(found))
+        if url.path.startswith('/api/v1/folders/') and url.path.endswith('/templates'):
+            state.count('GET /api/v1/folders/{id}/templates')
+            folder_id = url.path[len('/api/v1/folders/'):-len('/templates')]
+            if folder_id not in state.folders:
+                return self._reply(404, '{"error": "not found"}')
+            found = [t for i, t in sorted(state.templates.items()) if i.rsplit('/', 1)[0] == folder_id]
+            return self._reply(200, json.dumps(self._page(found, query)))
+        if url.path == '/api/v1/templates':
+            state.count('GET /api/v1/templates')
+            found = [t for i, t in sorted(state.templates.items())]
+            return self._reply(200, json.dumps(self._page(found, query)))
+        if url.path.startswith('/api/v1/templates/'):
+            state.count('GET /api/v1/templates/{id}')
+            template_id = url.path[len('/api/v1/templates/'):]
+            if template_id not in state.templates:
+                return self._reply(404, '{"error": "not found"}')
+            return self._reply(200, json.dumps(state.templates[template_id]))
+        if url.path.startswith('/api/v1/folders/'):
+            state.count('GET /api/v1/folders/{id}')
+            folder_id = url.path[len('/api/v1/folders/'):]
+            if folder_id not in state.folders:
+                return self._reply(404, '{"error": "not found"}')
+            return self._reply(200, json.dumps({'id': folder_id, 'title': state.folders[folder_id][0]}))
+        return self._reply(404, '{"error": "unknown endpoint"}')
+
+    def _page(self, items, query):
+        page = int(query.get('page', 0))
+        size = int(query.get('resultsPerPage', 100))
+        return items[page * size:(page + 1) * size]
+
+    def _folder_tree(self, parent_id):
+        return [{'id': i, 'title': title, 'children': self._folder_tree(i)}
+                for i, (title, p) in sorted(self.state.folders.items()) if p == parent_id]
+
+    def do_PUT(self):
+        self._delay()
+        url = urlparse(self.path)
+        body = self._read_body()
+        self.state.count('PUT ' + '/'.join(url.path.split('/')[:4]) + '/{id}')
+        return self._reply(200, body or b'{}')
+
+    def do_POST(self):
+        self._delay()
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        state = self.state
+        if url.path == '/api/v1/templates/import':
+            state.count('POST /api/v1/templates/import')
+            body = self._read_body()
+            if body is None:
+                return self._reply(415, '{"error": "unsupported content encoding"}')
+            if self.server.fail_next:
+                self.server.fail_next -= 1
+                return self._reply(503, '{"error": "try again later"}')
+            templates = json.loads(body.decode('utf-8'))
+            folder_id = query.get('folderId', 'Applications')
+            if folder_id != 'Applications' and folder_id not in state.folders:
+                return self._reply(404, '{"error": "folder not found"}')
+            results = []
+            with state.lock:
+                for template in templates:
+                    if 'FAIL' in template.get('title', ''):
+                        return self._reply(400, '{"error": "bad template"}')
+                    template_id = '%s/Release%d' % (folder_id, state._next())
+                    template = dict(template, id=template_id)
+                    state.templates[template_id] = template
+                    results.append({'id': template_id[len('Applications/'):].replace('/', '-'), 'warnings': []})
+            return self._reply(200, json.dumps(results))
+        return self._reply(404, '{"error": "unknown endpoint"}')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_remote_stub(state, latency=0.0, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.state = state
+    server.latency = latency
+    server.fail_next = 0
+    server.reject_gzip = False
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    """Serves the remote state from the given JSON file until the standard input is closed, so that the memory
+    used by the stand-in is not counted in the benchmark. Prints the port of the server."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('state_file', help='JSON with the "folder_paths" and the "configurations" of the remote')
+    parser.add_argument('--latency', type=float, default=0.0)
+    arguments = parser.parse_args()
+    with open(arguments.state_file) as f:
+        initial_state = json.load(f)
+    server = start_remote_stub(RemoteState(initial_state['folder_paths'], initial_state['configurations']),
+                               arguments.latency)
+    print(server.server_address[1])
+    sys.stdout.flush()
+    sys.stdin.read()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()